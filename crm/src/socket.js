@@ -1,4 +1,5 @@
 import { io } from 'socket.io-client'
+import { resubscribe } from './utils/realtime'
 import { socketio_port } from '../../../../sites/common_site_config.json'
 
 
@@ -18,6 +19,7 @@ export function initSocket() {
 
 	socket.on('connect', () => {
 		console.log('🟢 Socket connected successfully, ID:', socket.id)
+		resubscribe(socket)
 	})
 
 	socket.on('connect_error', (error) => {
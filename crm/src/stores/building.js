@@ -1,6 +1,7 @@
 import { defineStore } from 'pinia'
 import { createListResource, createDocumentResource } from 'frappe-ui'
 import { globalStore } from './global'
+import { applyRealtimeUpdate, batchIncludesDoc, subscribeDoc, subscribeDoctype, syncListResource } from '@/utils/realtime'
 
 export const useBuildingStore = defineStore('buildings', {
 	state: () => ({
@@ -62,6 +63,7 @@ export const useBuildingStore = defineStore('buildings', {
 
 				// Set up socket listener for our custom event
 				this.setupRealtimeListeners(global.socket)
+				subscribeDoctype(global.socket, 'PRP Building')
 			} else if (!this.buildingList) {
 				console.warn('Cannot initialize building list: Socket not available')
 			}
@@ -82,30 +84,47 @@ export const useBuildingStore = defineStore('buildings', {
 				if (data.cache_key === 'prp:prp_building') {
 					// Handle different event types
 					if (data.event === 'list_update') {
-						// Document was added or deleted, reload full list
-						console.log('Detected list change (add/delete), reloading building list')
-						this.refetchBuildings()
+						// Deleted rows are dropped in place, additions reload the full list
+						if (!applyRealtimeUpdate(this.buildingList, data)) {
+							console.log('Detected list change (add/delete), reloading building list')
+							this.refetchBuildings()
+						}
 					} else if (data.event === 'doc_update') {
 						// Single document was updated
-						console.log(`Detected document update for ${data.doc}`)
+						console.log(`Detected document update for ${data.docs?.join(', ')}`)
 
-						// If our current building was updated, refetch it
-						if (this.currentBuilding && this.currentBuilding.name === data.doc) {
-							this.refreshCurrentBuilding()
+						// Patch the cached row from the event, reload the list if that isn't possible
+						if (!applyRealtimeUpdate(this.buildingList, data)) {
+							this.refetchBuildings()
 						}
+					}
 
-						// Also refresh the list to show updated data
-						this.refetchBuildings()
+					// Large batches skip the document rooms, so the open building is refreshed from here
+					if (batchIncludesDoc(data, this.currentBuilding?.name)) {
+						this.refreshCurrentBuilding()
 					}
 				}
 			})
+
+			// Catch up on changes missed while disconnected
+			socket.io.on('reconnect', () => this.refetchBuildings())
+
+			// Changes to the open building arrive through its document room
+			socket.on('prp:doc_update', (data) => {
+				if (data.doctype === 'PRP Building' && this.currentBuilding?.name === data.doc) {
+					this.refreshCurrentBuilding()
+				}
+			})
 		},
 
 		// Refetch buildings when notified of changes
 		async refetchBuildings() {
 			if (this.buildingList) {
 				try {
-					await this.buildingList.reload()
+					// Pull only what changed since the last sync, reload when that isn't enough
+					if (!(await syncListResource(this.buildingList, 'PRP Building'))) {
+						await this.buildingList.reload()
+					}
 					return this.buildings
 				} catch (error) {
 					console.error('Error refetching buildings:', error)
@@ -224,6 +243,7 @@ export const useBuildingStore = defineStore('buildings', {
 				},
 				global.socket,
 			)
+			subscribeDoc(global.socket, 'PRP Building', buildingId)
 
 			try {
 				await this.currentBuildingResource.get.submit()
@@ -1,6 +1,7 @@
 import { defineStore } from 'pinia'
 import { createListResource, createDocumentResource } from 'frappe-ui'
 import { globalStore } from './global'
+import { applyRealtimeUpdate, batchIncludesDoc, subscribeDoc, subscribeDoctype, syncListResource } from '@/utils/realtime'
 
 export const useDocumentStore = defineStore('documents', {
 	state: () => ({
@@ -75,6 +76,7 @@ export const useDocumentStore = defineStore('documents', {
 
 				// Set up socket listener for our custom event
 				this.setupRealtimeListeners(global.socket)
+				subscribeDoctype(global.socket, 'PRP Document')
 			} else if (!this.documentList) {
 				console.warn('Cannot initialize document list: Socket not available')
 			}
@@ -95,25 +97,39 @@ export const useDocumentStore = defineStore('documents', {
 				if (data.cache_key === 'prp:prp_document') {
 					// Handle different event types
 					if (data.event === 'list_update') {
-						// Document was added or deleted, reload full list
-						console.log('Detected list change (add/delete), reloading document list')
-						this.refetchDocuments()
+						// Deleted rows are dropped in place, additions reload the full list
+						if (!applyRealtimeUpdate(this.documentList, data)) {
+							console.log('Detected list change (add/delete), reloading document list')
+							this.refetchDocuments()
+						}
 						// Clear the cache when documents are updated
 						this.clearDocumentRoomCache()
 					} else if (data.event === 'doc_update') {
 						// Single document was updated
-						console.log(`Detected document update for ${data.doc}`)
+						console.log(`Detected document update for ${data.docs?.join(', ')}`)
 
-						// If our current document was updated, refetch it
-						if (this.currentDocument && this.currentDocument.name === data.doc) {
-							this.refreshCurrentDocument()
+						// Patch the cached row from the event, reload the list if that isn't possible
+						if (!applyRealtimeUpdate(this.documentList, data)) {
+							this.refetchDocuments()
 						}
-
-						// Also refresh the list to show updated data
-						this.refetchDocuments()
 						// Clear the cache when documents are updated
 						this.clearDocumentRoomCache()
 					}
+
+					// Large batches skip the document rooms, so the open document is refreshed from here
+					if (batchIncludesDoc(data, this.currentDocument?.name)) {
+						this.refreshCurrentDocument()
+					}
+				}
+			})
+
+			// Catch up on changes missed while disconnected
+			socket.io.on('reconnect', () => this.refetchDocuments())
+
+			// Changes to the open document arrive through its document room
+			socket.on('prp:doc_update', (data) => {
+				if (data.doctype === 'PRP Document' && this.currentDocument?.name === data.doc) {
+					this.refreshCurrentDocument()
 				}
 			})
 		},
@@ -127,7 +143,10 @@ export const useDocumentStore = defineStore('documents', {
 		async refetchDocuments() {
 			if (this.documentList) {
 				try {
-					await this.documentList.reload()
+					// Pull only what changed since the last sync, reload when that isn't enough
+					if (!(await syncListResource(this.documentList, 'PRP Document'))) {
+						await this.documentList.reload()
+					}
 					return this.documents
 				} catch (error) {
 					console.error('Error refetching documents:', error)
@@ -231,6 +250,7 @@ export const useDocumentStore = defineStore('documents', {
 				},
 				global.socket,
 			)
+			subscribeDoc(global.socket, 'PRP Document', documentId)
 
 			try {
 				await this.currentDocumentResource.get.submit()
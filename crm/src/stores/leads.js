@@ -1,6 +1,8 @@
 import { defineStore } from 'pinia'
-import { createListResource, createDocumentResource } from 'frappe-ui'
+import { createListResource, createDocumentResource, call } from 'frappe-ui'
 import { globalStore } from './global'
+import { loadNextPage } from '@/utils/pagination'
+import { applyRealtimeUpdate, batchIncludesDoc, subscribeDoc, subscribeDoctype, syncListResource } from '@/utils/realtime'
 
 export const useLeadStore = defineStore('leads', {
 	state: () => ({
@@ -66,6 +68,7 @@ export const useLeadStore = defineStore('leads', {
 
 				// Set up socket listener for our custom event
 				this.setupRealtimeListeners(global.socket)
+				subscribeDoctype(global.socket, 'PRP Lead')
 
 				// console.log('✅ Lead list resource created successfully')
 			} else if (this.leadList) {
@@ -92,25 +95,38 @@ export const useLeadStore = defineStore('leads', {
 				if (data.cache_key === 'prp:prp_lead') {
 					// Handle different event types
 					if (data.event === 'list_update') {
-						// Document was added or deleted, reload full list
-						console.log('📋 Detected list change (add/delete), reloading lead list')
-						this.refetchLeads()
+						// Deleted rows are dropped in place, additions reload the full list
+						if (!applyRealtimeUpdate(this.leadList, data)) {
+							console.log('📋 Detected list change (add/delete), reloading lead list')
+							this.refetchLeads()
+						}
 					} else if (data.event === 'doc_update') {
 						// Single document was updated
-						console.log(`📄 Detected document update for ${data.doc}`)
+						console.log(`📄 Detected document update for ${data.docs?.join(', ')}`)
 
-						// If our current lead was updated, refetch it
-						if (this.currentLead && this.currentLead.name === data.doc) {
-							// console.log('🔄 Current lead was updated, refetching details')
-							this.refreshCurrentLead()
+						// Patch the cached row from the event, reload the list if that isn't possible
+						if (!applyRealtimeUpdate(this.leadList, data)) {
+							this.refetchLeads()
 						}
+					}
 
-						// Also refresh the list to show updated data
-						this.refetchLeads()
+					// Large batches skip the document rooms, so the open lead is refreshed from here
+					if (batchIncludesDoc(data, this.currentLead?.name)) {
+						this.refreshCurrentLead()
 					}
 				}
 			})
 
+			// Catch up on changes missed while disconnected
+			socket.io.on('reconnect', () => this.refetchLeads())
+
+			// Changes to the open lead arrive through its document room
+			socket.on('prp:doc_update', (data) => {
+				if (data.doctype === 'PRP Lead' && this.currentLead?.name === data.doc) {
+					this.refreshCurrentLead()
+				}
+			})
+
 			// console.log('✅ Realtime listeners setup complete')
 		},
 
@@ -119,7 +135,10 @@ export const useLeadStore = defineStore('leads', {
 			// console.log('🔄 Refetching leads due to realtime update')
 			if (this.leadList) {
 				try {
-					await this.leadList.reload()
+					// Pull only what changed since the last sync, reload when that isn't enough
+					if (!(await syncListResource(this.leadList, 'PRP Lead'))) {
+						await this.leadList.reload()
+					}
 					// console.log('✅ Leads refetched successfully')
 					return this.leads
 				} catch (error) {
@@ -166,7 +185,8 @@ export const useLeadStore = defineStore('leads', {
 		async loadMoreLeads() {
 			if (this.hasMoreLeads && this.leadList) {
 				try {
-					await this.leadList.next()
+					// Deep pages stay fast when read after the last row rather than at an offset
+					await loadNextPage(this.leadList, 'PRP Lead')
 				} catch (error) {
 					console.error('Error loading more leads:', error)
 				}
@@ -205,6 +225,17 @@ export const useLeadStore = defineStore('leads', {
 			}
 		},
 
+		// Fetch the listings that best match a lead's preferences
+		async fetchMatchingListings(leadId, limit = 20) {
+			try {
+				const result = await call('prp.match_index.get_lead_matches', { lead: leadId, limit })
+				return result.success ? result.matches : []
+			} catch (error) {
+				console.error(`Error fetching matching listings for ${leadId}:`, error)
+				return []
+			}
+		},
+
 		// Fetch a single lead by ID
 		async fetchLead(leadId) {
 			// console.log(`🔍 Fetching lead with ID: ${leadId}`)
@@ -230,6 +261,7 @@ export const useLeadStore = defineStore('leads', {
 				},
 				global.socket,
 			)
+			subscribeDoc(global.socket, 'PRP Lead', leadId)
 
 			try {
 				await this.currentLeadResource.get.submit()
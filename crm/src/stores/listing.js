@@ -1,6 +1,8 @@
 import { defineStore } from 'pinia'
-import { createListResource, createDocumentResource } from 'frappe-ui'
+import { createListResource, createDocumentResource, call } from 'frappe-ui'
 import { globalStore } from './global'
+import { loadNextPage } from '@/utils/pagination'
+import { applyRealtimeUpdate, batchIncludesDoc, subscribeDoc, subscribeDoctype, syncListResource } from '@/utils/realtime'
 
 export const useListingStore = defineStore('listings', {
 	state: () => ({
@@ -13,6 +15,11 @@ export const useListingStore = defineStore('listings', {
 
 		// Filters state
 		filters: {},
+
+		// Faceted search state
+		searchResults: [],
+		searchTotal: 0,
+		facets: {},
 	}),
 
 	getters: {
@@ -62,6 +69,7 @@ export const useListingStore = defineStore('listings', {
 
 				// Set up socket listener for our custom event
 				this.setupRealtimeListeners(global.socket)
+				subscribeDoctype(global.socket, 'PRP Listing')
 			} else if (!this.listingList) {
 				console.warn('Cannot initialize listing list: Socket not available')
 			}
@@ -82,30 +90,47 @@ export const useListingStore = defineStore('listings', {
 				if (data.cache_key === 'prp:prp_listing') {
 					// Handle different event types
 					if (data.event === 'list_update') {
-						// Document was added or deleted, reload full list
-						console.log('Detected list change (add/delete), reloading listing list')
-						this.refetchListings()
+						// Deleted rows are dropped in place, additions reload the full list
+						if (!applyRealtimeUpdate(this.listingList, data)) {
+							console.log('Detected list change (add/delete), reloading listing list')
+							this.refetchListings()
+						}
 					} else if (data.event === 'doc_update') {
 						// Single document was updated
-						console.log(`Detected document update for ${data.doc}`)
+						console.log(`Detected document update for ${data.docs?.join(', ')}`)
 
-						// If our current listing was updated, refetch it
-						if (this.currentListing && this.currentListing.name === data.doc) {
-							this.refreshCurrentListing()
+						// Patch the cached row from the event, reload the list if that isn't possible
+						if (!applyRealtimeUpdate(this.listingList, data)) {
+							this.refetchListings()
 						}
+					}
 
-						// Also refresh the list to show updated data
-						this.refetchListings()
+					// Large batches skip the document rooms, so the open listing is refreshed from here
+					if (batchIncludesDoc(data, this.currentListing?.name)) {
+						this.refreshCurrentListing()
 					}
 				}
 			})
+
+			// Catch up on changes missed while disconnected
+			socket.io.on('reconnect', () => this.refetchListings())
+
+			// Changes to the open listing arrive through its document room
+			socket.on('prp:doc_update', (data) => {
+				if (data.doctype === 'PRP Listing' && this.currentListing?.name === data.doc) {
+					this.refreshCurrentListing()
+				}
+			})
 		},
 
 		// Refetch listings when notified of changes
 		async refetchListings() {
 			if (this.listingList) {
 				try {
-					await this.listingList.reload()
+					// Pull only what changed since the last sync, reload when that isn't enough
+					if (!(await syncListResource(this.listingList, 'PRP Listing'))) {
+						await this.listingList.reload()
+					}
 					return this.listings
 				} catch (error) {
 					console.error('Error refetching listings:', error)
@@ -147,13 +172,49 @@ export const useListingStore = defineStore('listings', {
 		async loadMoreListings() {
 			if (this.hasMoreListings && this.listingList) {
 				try {
-					await this.listingList.next()
+					// Deep pages stay fast when read after the last row rather than at an offset
+					await loadNextPage(this.listingList, 'PRP Listing')
 				} catch (error) {
 					console.error('Error loading more listings:', error)
 				}
 			}
 		},
 
+		// Search listings with facet counts in one round trip
+		// filters: { field: value or [values] } for bedrooms, type, availability, status,
+		// payment_plan, developer, project and building; territory narrows results to a region
+		async searchListings({
+			filters = this.filters,
+			minPrice = null,
+			maxPrice = null,
+			start = 0,
+			pageLength = 20,
+			orderBy = 'creation desc',
+			territory = null,
+		} = {}) {
+			try {
+				const result = await call('prp.listing_search.search_listings', {
+					filters,
+					min_price: minPrice,
+					max_price: maxPrice,
+					start,
+					page_length: pageLength,
+					order_by: orderBy,
+					territory,
+				})
+
+				if (result.success) {
+					this.searchResults = start ? [...this.searchResults, ...result.results] : result.results
+					this.searchTotal = result.total
+					this.facets = result.facets || {}
+				}
+				return result
+			} catch (error) {
+				console.error('Error searching listings:', error)
+				throw error
+			}
+		},
+
 		// Update filters and reload
 		async updateFilters(newFilters) {
 			this.filters = { ...this.filters, ...newFilters }
@@ -186,6 +247,17 @@ export const useListingStore = defineStore('listings', {
 			}
 		},
 
+		// Fetch the leads whose preferences a listing matches best
+		async fetchMatchingLeads(listingId, limit = 20) {
+			try {
+				const result = await call('prp.match_index.get_listing_matches', { listing: listingId, limit })
+				return result.success ? result.matches : []
+			} catch (error) {
+				console.error(`Error fetching matching leads for ${listingId}:`, error)
+				return []
+			}
+		},
+
 		// Fetch a single listing by ID
 		async fetchListing(listingId) {
 			const global = globalStore()
@@ -209,6 +281,7 @@ export const useListingStore = defineStore('listings', {
 				},
 				global.socket,
 			)
+			subscribeDoc(global.socket, 'PRP Listing', listingId)
 
 			try {
 				await this.currentListingResource.get.submit()
@@ -1,6 +1,8 @@
 import { defineStore } from 'pinia'
 import { createListResource, createDocumentResource } from 'frappe-ui'
 import { globalStore } from './global'
+import { loadNextPage } from '@/utils/pagination'
+import { applyRealtimeUpdate, batchIncludesDoc, subscribeDoc, subscribeDoctype, syncListResource } from '@/utils/realtime'
 import { format } from 'date-fns'
 
 export const useNoteStore = defineStore('notes', {
@@ -91,6 +93,7 @@ export const useNoteStore = defineStore('notes', {
 
 				// Set up socket listener for our custom event
 				this.setupRealtimeListeners(global.socket)
+				subscribeDoctype(global.socket, 'PRP Note')
 			} else if (!this.noteList) {
 				console.warn('Cannot initialize note list: Socket not available')
 			}
@@ -111,23 +114,37 @@ export const useNoteStore = defineStore('notes', {
 				if (data.cache_key === 'prp:prp_note') {
 					// Handle different event types
 					if (data.event === 'list_update') {
-						// Document was added or deleted, reload full list
-						console.log('Detected list change (add/delete), reloading note list')
-						this.refetchNotes()
+						// Deleted rows are dropped in place, additions reload the full list
+						if (!applyRealtimeUpdate(this.noteList, data)) {
+							console.log('Detected list change (add/delete), reloading note list')
+							this.refetchNotes()
+						}
 					} else if (data.event === 'doc_update') {
 						// Single document was updated
-						console.log(`Detected document update for ${data.doc}`)
+						console.log(`Detected document update for ${data.docs?.join(', ')}`)
 
-						// If our current note was updated, refetch it
-						if (this.currentNote && this.currentNote.name === data.doc) {
-							this.refreshCurrentNote()
+						// Patch the cached row from the event, reload the list if that isn't possible
+						if (!applyRealtimeUpdate(this.noteList, data)) {
+							this.refetchNotes()
 						}
+					}
 
-						// Also refresh the list to show updated data
-						this.refetchNotes()
+					// Large batches skip the document rooms, so the open note is refreshed from here
+					if (batchIncludesDoc(data, this.currentNote?.name)) {
+						this.refreshCurrentNote()
 					}
 				}
 			})
+
+			// Catch up on changes missed while disconnected
+			socket.io.on('reconnect', () => this.refetchNotes())
+
+			// Changes to the open note arrive through its document room
+			socket.on('prp:doc_update', (data) => {
+				if (data.doctype === 'PRP Note' && this.currentNote?.name === data.doc) {
+					this.refreshCurrentNote()
+				}
+			})
 		},
 
 		formatDateForServer(date) {
@@ -147,7 +164,10 @@ export const useNoteStore = defineStore('notes', {
 		async refetchNotes() {
 			if (this.noteList) {
 				try {
-					await this.noteList.reload()
+					// Pull only what changed since the last sync, reload when that isn't enough
+					if (!(await syncListResource(this.noteList, 'PRP Note'))) {
+						await this.noteList.reload()
+					}
 					return this.notes
 				} catch (error) {
 					console.error('Error refetching notes:', error)
@@ -187,7 +207,8 @@ export const useNoteStore = defineStore('notes', {
 		async loadMoreNotes() {
 			if (this.hasMoreNotes && this.noteList) {
 				try {
-					await this.noteList.next()
+					// Deep pages stay fast when read after the last row rather than at an offset
+					await loadNextPage(this.noteList, 'PRP Note')
 				} catch (error) {
 					console.error('Error loading more notes:', error)
 				}
@@ -249,6 +270,7 @@ export const useNoteStore = defineStore('notes', {
 				},
 				global.socket,
 			)
+			subscribeDoc(global.socket, 'PRP Note', noteId)
 
 			try {
 				await this.currentNoteResource.get.submit()
@@ -1,6 +1,7 @@
 import { defineStore } from 'pinia'
 import { createListResource, createDocumentResource } from 'frappe-ui'
 import { globalStore } from './global'
+import { applyRealtimeUpdate, batchIncludesDoc, subscribeDoc, subscribeDoctype, syncListResource } from '@/utils/realtime'
 
 export const usePreferenceStore = defineStore('preferences', {
 	state: () => ({
@@ -66,6 +67,7 @@ export const usePreferenceStore = defineStore('preferences', {
 
 				// Set up socket listener for our custom event
 				this.setupRealtimeListeners(global.socket)
+				subscribeDoctype(global.socket, 'PRP Preference')
 
 				// console.log('✅ Preference list resource created successfully')
 			} else if (this.preferenceList) {
@@ -92,25 +94,38 @@ export const usePreferenceStore = defineStore('preferences', {
 				if (data.cache_key === 'prp:prp_preference') {
 					// Handle different event types
 					if (data.event === 'list_update') {
-						// Document was added or deleted, reload full list
-						console.log('📋 Detected list change (add/delete), reloading preference list',)
-						this.refetchPreferences()
+						// Deleted rows are dropped in place, additions reload the full list
+						if (!applyRealtimeUpdate(this.preferenceList, data)) {
+							console.log('📋 Detected list change (add/delete), reloading preference list',)
+							this.refetchPreferences()
+						}
 					} else if (data.event === 'doc_update') {
 						// Single document was updated
-						console.log(`📄 Detected document update for ${data.doc}`)
+						console.log(`📄 Detected document update for ${data.docs?.join(', ')}`)
 
-						// If our current preference was updated, refetch it
-						if (this.currentPreference && this.currentPreference.name === data.doc) {
-							// console.log('🔄 Current preference was updated, refetching details')
-							this.refreshCurrentPreference()
+						// Patch the cached row from the event, reload the list if that isn't possible
+						if (!applyRealtimeUpdate(this.preferenceList, data)) {
+							this.refetchPreferences()
 						}
+					}
 
-						// Also refresh the list to show updated data
-						this.refetchPreferences()
+					// Large batches skip the document rooms, so the open preference is refreshed from here
+					if (batchIncludesDoc(data, this.currentPreference?.name)) {
+						this.refreshCurrentPreference()
 					}
 				}
 			})
 
+			// Catch up on changes missed while disconnected
+			socket.io.on('reconnect', () => this.refetchPreferences())
+
+			// Changes to the open preference arrive through its document room
+			socket.on('prp:doc_update', (data) => {
+				if (data.doctype === 'PRP Preference' && this.currentPreference?.name === data.doc) {
+					this.refreshCurrentPreference()
+				}
+			})
+
 			// console.log('✅ Preference realtime listeners setup complete')
 		},
 
@@ -119,7 +134,10 @@ export const usePreferenceStore = defineStore('preferences', {
 			// console.log('🔄 Refetching preferences due to realtime update')
 			if (this.preferenceList) {
 				try {
-					await this.preferenceList.reload()
+					// Pull only what changed since the last sync, reload when that isn't enough
+					if (!(await syncListResource(this.preferenceList, 'PRP Preference'))) {
+						await this.preferenceList.reload()
+					}
 					// console.log('✅ Preferences refetched successfully')
 					return this.preferences
 				} catch (error) {
@@ -230,6 +248,7 @@ export const usePreferenceStore = defineStore('preferences', {
 				},
 				global.socket,
 			)
+			subscribeDoc(global.socket, 'PRP Preference', preferenceId)
 
 			try {
 				await this.currentPreferenceResource.get.submit()
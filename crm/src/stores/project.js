@@ -1,6 +1,7 @@
 import { defineStore } from 'pinia'
 import { createListResource, createDocumentResource } from 'frappe-ui'
 import { globalStore } from './global'
+import { applyRealtimeUpdate, batchIncludesDoc, subscribeDoc, subscribeDoctype, syncListResource } from '@/utils/realtime'
 
 export const useProjectStore = defineStore('projects', {
 	state: () => ({
@@ -62,6 +63,7 @@ export const useProjectStore = defineStore('projects', {
 
 				// Set up socket listener for our custom event
 				this.setupRealtimeListeners(global.socket)
+				subscribeDoctype(global.socket, 'PRP Project')
 			} else if (!this.projectList) {
 				console.warn('Cannot initialize project list: Socket not available')
 			}
@@ -82,30 +84,47 @@ export const useProjectStore = defineStore('projects', {
 				if (data.cache_key === 'prp:prp_project') {
 					// Handle different event types
 					if (data.event === 'list_update') {
-						// Document was added or deleted, reload full list
-						console.log('Detected list change (add/delete), reloading project list')
-						this.refetchProjects()
+						// Deleted rows are dropped in place, additions reload the full list
+						if (!applyRealtimeUpdate(this.projectList, data)) {
+							console.log('Detected list change (add/delete), reloading project list')
+							this.refetchProjects()
+						}
 					} else if (data.event === 'doc_update') {
 						// Single document was updated
-						console.log(`Detected document update for ${data.doc}`)
+						console.log(`Detected document update for ${data.docs?.join(', ')}`)
 
-						// If our current project was updated, refetch it
-						if (this.currentProject && this.currentProject.name === data.doc) {
-							this.refreshCurrentProject()
+						// Patch the cached row from the event, reload the list if that isn't possible
+						if (!applyRealtimeUpdate(this.projectList, data)) {
+							this.refetchProjects()
 						}
+					}
 
-						// Also refresh the list to show updated data
-						this.refetchProjects()
+					// Large batches skip the document rooms, so the open project is refreshed from here
+					if (batchIncludesDoc(data, this.currentProject?.name)) {
+						this.refreshCurrentProject()
 					}
 				}
 			})
+
+			// Catch up on changes missed while disconnected
+			socket.io.on('reconnect', () => this.refetchProjects())
+
+			// Changes to the open project arrive through its document room
+			socket.on('prp:doc_update', (data) => {
+				if (data.doctype === 'PRP Project' && this.currentProject?.name === data.doc) {
+					this.refreshCurrentProject()
+				}
+			})
 		},
 
 		// Refetch projects when notified of changes
 		async refetchProjects() {
 			if (this.projectList) {
 				try {
-					await this.projectList.reload()
+					// Pull only what changed since the last sync, reload when that isn't enough
+					if (!(await syncListResource(this.projectList, 'PRP Project'))) {
+						await this.projectList.reload()
+					}
 					return this.projects
 				} catch (error) {
 					console.error('Error refetching projects:', error)
@@ -209,6 +228,7 @@ export const useProjectStore = defineStore('projects', {
 				},
 				global.socket,
 			)
+			subscribeDoc(global.socket, 'PRP Project', projectId)
 
 			try {
 				await this.currentProjectResource.get.submit()
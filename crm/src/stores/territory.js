@@ -1,6 +1,7 @@
 import { defineStore } from 'pinia'
 import { createListResource, createDocumentResource, call } from 'frappe-ui'
 import { globalStore } from './global'
+import { applyRealtimeUpdate, batchIncludesDoc, subscribeDoc, subscribeDoctype, syncListResource } from '@/utils/realtime'
 
 export const useTerritoryStore = defineStore('territories', {
 	state: () => ({
@@ -57,7 +58,22 @@ export const useTerritoryStore = defineStore('territories', {
 				this.territoryList = createListResource(
 					{
 						doctype: 'PRP Territory',
-						fields: ['*'],
+						// Serves `geo` as a simplified copy instead of the full resolution boundary
+						url: 'prp.prp.doctype.prp_territory.prp_territory.get_territories',
+						fields: [
+							'name',
+							'osm_id',
+							'territory_name',
+							'name_en',
+							'name_ar',
+							'parent_territory',
+							'is_project',
+							'is_phase',
+							'is_custom',
+							'lat',
+							'lng',
+							'geo',
+						],
 						orderBy: 'name_en asc',
 						start: 0,
 						pageLength: 50,
@@ -78,6 +94,7 @@ export const useTerritoryStore = defineStore('territories', {
 
 				// Set up socket listener for our custom event
 				this.setupRealtimeListeners(global.socket)
+				subscribeDoctype(global.socket, 'PRP Territory')
 			} else if (!this.territoryList) {
 				console.warn('Cannot initialize territory list: Socket not available')
 			}
@@ -98,30 +115,101 @@ export const useTerritoryStore = defineStore('territories', {
 				if (data.cache_key === 'prp:prp_territory') {
 					// Handle different event types
 					if (data.event === 'list_update') {
-						// Document was added or deleted, reload full list
-						console.log('Detected list change (add/delete), reloading territory list')
-						this.refetchTerritories()
+						// Deleted rows are dropped in place, additions reload the full list
+						if (!applyRealtimeUpdate(this.territoryList, data)) {
+							console.log('Detected list change (add/delete), reloading territory list')
+							this.refetchTerritories()
+						}
 					} else if (data.event === 'doc_update') {
 						// Single document was updated
-						console.log(`Detected document update for ${data.doc}`)
+						console.log(`Detected document update for ${data.docs?.join(', ')}`)
 
-						// If our current territory was updated, refetch it
-						if (this.currentTerritory && this.currentTerritory.name === data.doc) {
-							this.refreshCurrentTerritory()
+						// Patch the cached row from the event, reload the list if that isn't possible
+						if (!applyRealtimeUpdate(this.territoryList, data)) {
+							this.refetchTerritories()
 						}
+					}
 
-						// Also refresh the list to show updated data
-						this.refetchTerritories()
+					// Large batches skip the document rooms, so the open territory is refreshed from here
+					if (batchIncludesDoc(data, this.currentTerritory?.name)) {
+						this.refreshCurrentTerritory()
 					}
 				}
 			})
+
+			// Catch up on changes missed while disconnected
+			socket.io.on('reconnect', () => this.refetchTerritories())
+
+			// Changes to the open territory arrive through its document room
+			socket.on('prp:doc_update', (data) => {
+				if (data.doctype === 'PRP Territory' && this.currentTerritory?.name === data.doc) {
+					this.refreshCurrentTerritory()
+				}
+			})
+
+			// Hierarchy detection runs in a background job after a territory is created
+			socket.on('prp:territory_hierarchy', (data) => {
+				if (data.potential_phases?.length) {
+					this.potentialPhases = data.potential_phases
+				}
+
+				if (this.currentTerritory && this.currentTerritory.name === data.territory) {
+					this.refreshCurrentTerritory()
+				}
+			})
+		},
+
+		// Poll the state of the background hierarchy update for a territory
+		async fetchHierarchyStatus(osmId) {
+			try {
+				const result = await call(
+					'prp.prp.doctype.prp_territory.prp_territory.get_territory_hierarchy_status',
+					{ territory: osmId },
+				)
+
+				if (result.potential_phases?.length) {
+					this.potentialPhases = result.potential_phases
+				}
+				return result
+			} catch (error) {
+				console.error(`Error fetching hierarchy status for ${osmId}:`, error)
+				return null
+			}
+		},
+
+		// Poll until the background hierarchy update of a new territory has finished
+		async waitForHierarchy(osmId, timeout = 60000, interval = 2000) {
+			const deadline = Date.now() + timeout
+			let result = await this.fetchHierarchyStatus(osmId)
+			while (result && ['Queued', 'Running'].includes(result.status) && Date.now() < deadline) {
+				await new Promise((resolve) => setTimeout(resolve, interval))
+				result = await this.fetchHierarchyStatus(osmId)
+			}
+			return result
+		},
+
+		// Fetch territory geometries at a level of detail suited to the map zoom
+		// ('low', 'medium', 'high' or 'full'), keyed by territory name
+		async fetchTerritoryGeometries(names, detail = 'medium') {
+			try {
+				return await call(
+					'prp.prp.doctype.prp_territory.prp_territory.get_territory_geometries',
+					{ names, detail },
+				)
+			} catch (error) {
+				console.error('Error fetching territory geometries:', error)
+				return {}
+			}
 		},
 
 		// Refetch territories when notified of changes
 		async refetchTerritories() {
 			if (this.territoryList) {
 				try {
-					await this.territoryList.reload()
+					// Pull only what changed since the last sync, reload when that isn't enough
+					if (!(await syncListResource(this.territoryList, 'PRP Territory'))) {
+						await this.territoryList.reload()
+					}
 					return this.territories
 				} catch (error) {
 					console.error('Error refetching territories:', error)
@@ -234,6 +322,7 @@ export const useTerritoryStore = defineStore('territories', {
 				},
 				global.socket,
 			)
+			subscribeDoc(global.socket, 'PRP Territory', osmId)
 
 			try {
 				await this.currentTerritoryResource.get.submit()
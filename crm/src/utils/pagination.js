@@ -0,0 +1,26 @@
+/**
+ * Keyset paging for list resources ordered by creation desc, see prp.pagination
+ */
+
+import { call } from 'frappe-ui'
+
+// Append the page after the last loaded row instead of reading it at an offset
+export async function loadNextPage(resource, doctype) {
+	const rows = resource.data || []
+	const last = rows[rows.length - 1]
+
+	const page = await call('prp.pagination.get_list_page', {
+		doctype,
+		fields: resource.fields,
+		filters: resource.filters,
+		after: last ? { creation: last.creation, name: last.name } : null,
+		page_length: resource.pageLength,
+	})
+	if (!page.success) {
+		throw new Error(page.message)
+	}
+
+	resource.setData([...rows, ...page.rows])
+	resource.hasNextPage = page.has_more
+	return page.rows
+}
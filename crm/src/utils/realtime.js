@@ -0,0 +1,94 @@
+/**
+ * Apply batched prp:refetch_resource events to cached list resources in place
+ */
+
+import { call } from 'frappe-ui'
+
+// Last batch version seen for each cache key
+const lastVersions = {}
+
+// Returns false when the list has to be reloaded instead
+export function applyRealtimeUpdate(resource, event) {
+	const lastVersion = lastVersions[event.cache_key]
+	lastVersions[event.cache_key] = Math.max(lastVersion || 0, event.version || 0)
+
+	if (!resource || !event.version || !event.changes?.length) return false
+
+	// A skipped or out of order version means we missed changes
+	if (lastVersion && event.version !== lastVersion + 1) return false
+
+	// New rows reload the list so ordering and paging stay right
+	if (event.changes.some((change) => change.action === 'insert' || !change.data?.name)) return false
+
+	let rows = resource.data || []
+	for (const change of event.changes) {
+		const name = change.data.name
+		if (change.action === 'delete') {
+			rows = rows.filter((row) => row.name !== name)
+		} else {
+			rows = rows.map((row) => (row.name === name ? { ...row, ...change.data } : row))
+		}
+	}
+	resource.setData(rows)
+	return true
+}
+
+// Whether a batch changed a document without sending it a prp:doc_update of its own
+export function batchIncludesDoc(event, name) {
+	return Boolean(name) && !event.doc_updates && Boolean(event.docs?.includes(name))
+}
+
+// Realtime rooms joined by this client: doctypes whose lists are shown and the open document of each doctype
+const subscribedDoctypes = new Set()
+const subscribedDocs = {}
+
+export function subscribeDoctype(socket, doctype) {
+	if (!socket || subscribedDoctypes.has(doctype)) return
+	subscribedDoctypes.add(doctype)
+	socket.emit('doctype_subscribe', doctype)
+}
+
+export function subscribeDoc(socket, doctype, name) {
+	if (!socket || subscribedDocs[doctype] === name) return
+	// Large batches reach the open document only through the doctype room
+	subscribeDoctype(socket, doctype)
+	if (subscribedDocs[doctype]) {
+		socket.emit('doc_unsubscribe', doctype, subscribedDocs[doctype])
+	}
+	subscribedDocs[doctype] = name
+	socket.emit('doc_subscribe', doctype, name)
+}
+
+// Rooms don't survive a reconnect, join them again
+export function resubscribe(socket) {
+	subscribedDoctypes.forEach((doctype) => socket.emit('doctype_subscribe', doctype))
+	Object.entries(subscribedDocs).forEach(([doctype, name]) => socket.emit('doc_subscribe', doctype, name))
+}
+
+// Sync cursor of each doctype, see prp.sync.get_changes
+const syncCursors = {}
+
+// Pull what changed since the last sync into a cached list, returns false when it has to be reloaded instead
+export async function syncListResource(resource, doctype) {
+	const cursor = syncCursors[doctype]
+	if (resource?.data && cursor) {
+		const result = await call('prp.sync.get_changes', { doctype, cursor })
+		if (result.success && !result.has_more && !result.inserted.length) {
+			syncCursors[doctype] = result.cursor
+
+			const deleted = new Set(result.deleted)
+			const changes = Object.fromEntries(result.changes.map((row) => [row.name, row]))
+			resource.setData(
+				resource.data
+					.filter((row) => !deleted.has(row.name))
+					.map((row) => (changes[row.name] ? { ...row, ...changes[row.name] } : row)),
+			)
+			return true
+		}
+	}
+
+	// Take a fresh cursor before the caller reloads so nothing changed meanwhile is missed
+	const result = await call('prp.sync.get_changes', { doctype })
+	syncCursors[doctype] = result.cursor
+	return false
+}
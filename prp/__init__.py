@@ -1,18 +1,110 @@
+from functools import partial
+
 import frappe
+from frappe.model import no_value_fields
+from frappe.model.document import Document
+
+from prp.realtime import queue_refetch_event
 
 
 __version__ = "0.0.1"
+
+# Left out of realtime payloads, clients fetch the document for these
+BULKY_FIELDTYPES = (
+    "Table",
+    "Table MultiSelect",
+    "JSON",
+    "Code",
+    "Geolocation",
+    "Long Text",
+    "Text Editor",
+    "HTML Editor",
+    "Markdown Editor",
+)
+
+
 # Modify your function
-def refetch_resource(doc, event=None):
+def refetch_resource(doc, event=None, action=None):
     """
     Refresh cache for the given document type.
     This function will be called by Frappe's doc events.
+
+    The change carries the document's list view fields, or only the fields that
+    changed when it was just saved. Changes are published in batches once the
+    transaction commits, see prp.realtime. Clients patch their cached rows with
+    the data and reload only when they see a gap in the batch versions.
+
+    action: "insert", "update" or "delete", defaults to "update" for doc_update
+    events and "insert" for list_update events
     """
     # Get the cache key based on doctype
     cache_key = f"prp:{doc.doctype.lower().replace(' ', '_')}"
 
-    frappe.publish_realtime(
-        "prp:refetch_resource",
-        {"cache_key": cache_key, "doc": doc.name, "doctype": doc.doctype, "event": event},
-        after_commit=True,
+    queue_refetch_event(
+        cache_key,
+        doc.doctype,
+        {
+            "doc": doc.name,
+            "event": event,
+            "action": action or ("update" if event == "doc_update" else "insert"),
+            "data": get_realtime_data(doc, action) if doc.name else None,
+        },
     )
+
+
+def get_list_view_fields(meta):
+    return [
+        df.fieldname
+        for df in meta.fields
+        if (df.in_list_view or df.in_standard_filter or df.fieldname == meta.title_field)
+        and df.fieldtype not in BULKY_FIELDTYPES
+    ]
+
+
+def get_realtime_data(doc, action=None):
+    """Get the values a client needs to patch its cached row of the document"""
+    if action == "delete":
+        return {"name": doc.name}
+
+    # Values written directly to the database, see update_doc_fields
+    if not isinstance(doc, Document):
+        return {field: value for field, value in doc.items() if field != "doctype"}
+
+    meta = frappe.get_meta(doc.doctype)
+    before = doc.get_doc_before_save()
+    if before:
+        fields = [
+            df.fieldname
+            for df in meta.fields
+            if df.fieldtype not in no_value_fields and df.fieldtype not in BULKY_FIELDTYPES
+        ]
+        data = {field: doc.get(field) for field in fields if doc.get(field) != before.get(field)}
+    else:
+        data = {field: doc.get(field) for field in get_list_view_fields(meta)}
+
+    data.update({"name": doc.name, "modified": doc.modified})
+    return data
+
+
+def run_after_commit(func):
+    """Run a function once the current transaction commits, at most once per transaction
+
+    Used to invalidate shared caches, so no reader can refill them from data that
+    is not committed yet (or never will be). Runs right away in tests.
+    """
+    if frappe.flags.in_test:
+        func()
+        return
+
+    pending = frappe.flags.setdefault("prp_after_commit", set())
+    if func in pending:
+        return
+
+    pending.add(func)
+    frappe.db.after_commit.add(partial(run_pending, func))
+    frappe.db.after_rollback.add(partial(pending.discard, func))
+
+
+def run_pending(func):
+    frappe.flags.prp_after_commit.discard(func)
+    func()
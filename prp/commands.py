@@ -0,0 +1,26 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("reconcile-hierarchy-counters")
+@pass_context
+def reconcile_hierarchy_counters(context):
+    """Recompute building and project counters from their listings"""
+    import frappe
+
+    from prp.prp.doctype.prp_listing.prp_listing import reconcile_hierarchy_counters
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        result = reconcile_hierarchy_counters()
+        frappe.db.commit()
+    finally:
+        frappe.destroy()
+
+    click.echo(result["message"])
+    if not result["success"]:
+        raise click.Abort()
+
+
+commands = [reconcile_hierarchy_counters]
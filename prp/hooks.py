@@ -151,6 +151,17 @@ app_license = "mit"
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+	"cron": {
+		"* * * * *": [
+			"prp.realtime.publish_held_events"
+		],
+	},
+	"daily": [
+		"prp.prp.doctype.prp_listing.prp_listing.recompute_all_hierarchies"
+	],
+}
+
 # scheduler_events = {
 # 	"all": [
 # 		"prp.tasks.all"
@@ -197,6 +208,9 @@ app_license = "mit"
 
 # ignore_links_on_delete = ["Communication", "ToDo"]
 
+# Match rows of deleted leads, preferences and listings are cleaned up by prp.match_index
+ignore_links_on_delete = ["PRP Match"]
+
 # Request Events
 # ----------------
 # before_request = ["prp.utils.before_request"]
@@ -0,0 +1,197 @@
+"""
+Bulk import and update of PRP Listings from developer price lists.
+
+Rows come from a CSV, XLSX or JSON file (or a JSON payload) and are written in
+batches with the per-listing building and project rollups switched off. Every
+touched building and project is then recounted once with set-based queries.
+"""
+
+import csv
+import io
+import json
+import os
+
+import frappe
+from frappe.utils import cint, flt
+from frappe.utils.xlsxutils import read_xlsx_file_from_attached_file
+
+from prp.match_index import enqueue_match_update
+from prp.prp.doctype.prp_listing.prp_listing import rollup_hierarchies
+
+IMPORT_BATCH_SIZE = 200
+
+# Imports with more rows than this run in a background job
+SYNC_IMPORT_LIMIT = 200
+
+
+def read_rows(file_url=None, data=None):
+    """Read the rows to import as dicts from an uploaded file or a JSON payload"""
+    if data is not None:
+        rows = frappe.parse_json(data)
+        return rows if isinstance(rows, list) else [rows]
+
+    if not file_url:
+        frappe.throw("Either a file or data is required")
+
+    file_doc = frappe.get_doc("File", {"file_url": file_url})
+    extension = os.path.splitext(file_doc.file_name or file_url)[1].lower()
+    content = file_doc.get_content()
+
+    if extension == ".json":
+        rows = json.loads(content)
+        return rows if isinstance(rows, list) else [rows]
+
+    if extension == ".xlsx":
+        table = read_xlsx_file_from_attached_file(fcontent=content)
+    elif extension == ".csv":
+        if isinstance(content, bytes):
+            content = content.decode("utf-8-sig")
+        table = list(csv.reader(io.StringIO(content)))
+    else:
+        frappe.throw(f"Unsupported file type {extension}, expected CSV, XLSX or JSON")
+
+    if not table:
+        return []
+
+    header = [str(column or "").strip() for column in table[0]]
+    return [dict(zip(header, row, strict=False)) for row in table[1:] if any(cell not in (None, "") for cell in row)]
+
+
+def get_column_map():
+    """Map column headers (field names or labels) to PRP Listing fields"""
+    column_map = {}
+    for df in frappe.get_meta("PRP Listing").fields:
+        column_map[df.fieldname] = df
+        if df.label:
+            column_map.setdefault(df.label.lower(), df)
+    return column_map
+
+
+def normalize_row(row, column_map):
+    """Convert an imported row into field values, dropping unknown columns and blanks"""
+    values = {}
+    for column, value in row.items():
+        df = column_map.get(column) or column_map.get(str(column).strip().lower())
+        if not df or value in (None, ""):
+            continue
+
+        if df.fieldtype in ("Currency", "Float"):
+            value = flt(value)
+        elif df.fieldtype in ("Int", "Check"):
+            value = cint(value)
+        elif df.fieldtype != "Table":
+            value = str(value).strip()
+
+        values[df.fieldname] = value
+    return values
+
+
+@frappe.whitelist()
+def import_listings(file_url=None, data=None, update_existing=1):
+    """Insert or update listings in bulk from a CSV/XLSX/JSON file or a JSON payload
+
+    Small imports run right away; larger ones are queued and their result is
+    published to the user as a "prp:listing_import" realtime event.
+    """
+    frappe.has_permission("PRP Listing", "create", throw=True)
+
+    try:
+        rows = read_rows(file_url, data)
+    except Exception as e:
+        frappe.log_error(f"Error reading listing import: {str(e)}", "PRP Listing Import")
+        return {"success": False, "message": str(e)}
+
+    if len(rows) <= SYNC_IMPORT_LIMIT:
+        return run_listing_import(rows, update_existing)
+
+    frappe.enqueue(
+        "prp.listing_import.run_listing_import",
+        queue="long",
+        timeout=3600,
+        rows=rows,
+        update_existing=update_existing,
+        user=frappe.session.user,
+        enqueue_after_commit=True,
+    )
+    return {"success": True, "queued": True, "message": f"Importing {len(rows)} listings in the background"}
+
+
+def run_listing_import(rows, update_existing=1, user=None):
+    """Write the rows in batches, then roll up every touched building and project once"""
+    column_map = get_column_map()
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+    errors = []
+    buildings = set()
+    listings = []
+
+    defer_hierarchy_rollup = frappe.flags.defer_hierarchy_rollup
+    frappe.flags.defer_hierarchy_rollup = True
+    try:
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            for idx, row in enumerate(rows[start : start + IMPORT_BATCH_SIZE], start=start + 1):
+                frappe.db.savepoint("listing_import_row")
+                try:
+                    result, name, touched = import_row(normalize_row(row, column_map), cint(update_existing))
+                    counts[result] += 1
+                    buildings.update(touched)
+                    if result != "skipped":
+                        listings.append(name)
+                except Exception as e:
+                    frappe.db.rollback(save_point="listing_import_row")
+                    errors.append({"row": idx, "message": str(e)})
+
+            if user:
+                frappe.db.commit()
+                frappe.publish_realtime(
+                    "prp:listing_import_progress",
+                    {"processed": min(start + IMPORT_BATCH_SIZE, len(rows)), "total": len(rows)},
+                    user=user,
+                )
+    finally:
+        frappe.flags.defer_hierarchy_rollup = defer_hierarchy_rollup
+
+    try:
+        rollup = rollup_hierarchies(buildings)
+    except Exception as e:
+        frappe.log_error(f"Error rolling up imported listings: {str(e)}", "PRP Listing Import")
+        rollup = {"buildings": [], "projects": []}
+        errors.append({"row": None, "message": f"Rollup failed, run reconcile_hierarchy_counters: {str(e)}"})
+
+    for name in listings:
+        enqueue_match_update(listing=name)
+
+    result = {
+        "success": not errors,
+        "message": f"Inserted {counts['inserted']}, updated {counts['updated']} and skipped {counts['skipped']} listings"
+        + (f" with {len(errors)} errors" if errors else ""),
+        **counts,
+        "errors": errors,
+        "buildings_updated": len(rollup["buildings"]),
+        "projects_updated": len(rollup["projects"]),
+    }
+
+    if user:
+        frappe.db.commit()
+        frappe.publish_realtime("prp:listing_import", result, user=user)
+
+    return result
+
+
+def import_row(values, update_existing):
+    """Insert or update one listing, returning the outcome, its name and the buildings it touched"""
+    if not values.get("building") or not values.get("unit_id"):
+        frappe.throw("Building and Unit ID are required")
+
+    name = f"{values['building']}-{values['unit_id']}"
+    if not frappe.db.exists("PRP Listing", name):
+        doc = frappe.get_doc({"doctype": "PRP Listing", **values})
+        doc.insert()
+        return "inserted", doc.name, {doc.building}
+
+    if not update_existing:
+        return "skipped", name, set()
+
+    doc = frappe.get_doc("PRP Listing", name)
+    doc.update(values)
+    doc.save()
+    return "updated", doc.name, {doc.building}
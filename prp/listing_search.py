@@ -0,0 +1,181 @@
+"""
+Faceted search over PRP Listings.
+
+A search returns a page of listings together with the count of matching
+listings for every value of each facet. Facet counts are disjunctive: the
+counts for a facet ignore that facet's own selection, so the UI can show how
+many results picking another value would give. Like the results, they only
+count listings the user may read. They are cached in Redis per user under a
+version that is bumped after every commit that changes a listing.
+"""
+
+import hashlib
+import json
+
+import frappe
+from frappe.utils import cint, flt
+
+import prp
+from prp.prp.doctype.prp_territory_closure.prp_territory_closure import get_cached_descendants
+
+FACET_FIELDS = ["bedrooms", "type", "availability", "status", "payment_plan", "developer", "project"]
+
+# Fields that can be filtered on besides the facets
+FILTER_FIELDS = FACET_FIELDS + ["building", "enable_secondhand_selling", "enable_secondhand_renting"]
+
+RESULT_FIELDS = [
+    "name",
+    "unit_id",
+    "building",
+    "project",
+    "developer",
+    "availability",
+    "status",
+    "bedrooms",
+    "type",
+    "unit_price",
+    "downpayment",
+    "payment_plan",
+    "enable_secondhand_selling",
+    "enable_secondhand_renting",
+    "modified",
+]
+
+ORDER_BY_OPTIONS = ("creation desc", "modified desc", "unit_price asc", "unit_price desc")
+
+FACET_VERSION_KEY = "prp:listing_facets_version"
+FACET_CACHE_TTL = 3600
+
+
+def get_facet_version():
+    version = frappe.cache().get_value(FACET_VERSION_KEY)
+    if not version:
+        version = frappe.generate_hash(length=10)
+        frappe.cache().set_value(FACET_VERSION_KEY, version)
+    return version
+
+
+def clear_facet_cache():
+    """Invalidate every cached facet count by moving to a new version, once the transaction commits"""
+    prp.run_after_commit(bump_facet_version)
+
+
+def bump_facet_version():
+    frappe.cache().set_value(FACET_VERSION_KEY, frappe.generate_hash(length=10))
+
+
+def parse_filters(filters):
+    """Turn {field: value or [values]} selections into {field: [operator, value]}"""
+    filters = frappe.parse_json(filters) if filters else {}
+
+    parsed = {}
+    for field, value in filters.items():
+        if field not in FILTER_FIELDS:
+            frappe.throw(f"Cannot filter listings by {field}")
+        if value in (None, "", []):
+            continue
+        parsed[field] = ["in", value] if isinstance(value, list) else ["=", value]
+    return parsed
+
+
+def get_filter_list(filters, base_filters, exclude=None):
+    return [[field, *condition] for field, condition in filters.items() if field != exclude] + base_filters
+
+
+def get_base_filters(min_price=None, max_price=None, territory=None):
+    """Get the filters applied to results and every facet alike"""
+    base_filters = []
+    if min_price not in (None, ""):
+        base_filters.append(["unit_price", ">=", flt(min_price)])
+    if max_price not in (None, ""):
+        base_filters.append(["unit_price", "<=", flt(max_price)])
+    if territory:
+        base_filters.append(["project", "in", get_projects_in_territory(territory) or [""]])
+    return base_filters
+
+
+def get_projects_in_territory(territory):
+    """Get the projects whose territory lies at or under a territory"""
+    return frappe.get_all(
+        "PRP Project", filters={"territory": ["in", list(get_cached_descendants(territory))]}, pluck="name"
+    )
+
+
+def get_facet_counts(filters, base_filters):
+    """Get {facet: {value: count}} for the current selection, from the cache when possible"""
+    version = get_facet_version()
+    facets = {}
+
+    for facet in FACET_FIELDS:
+        # Disjunctive faceting: a facet's counts ignore its own selection
+        facet_filters = get_filter_list(filters, base_filters, exclude=facet)
+
+        # Counts go through the user's permissions, so they are cached per user
+        key = hashlib.md5(
+            json.dumps([frappe.session.user, facet, facet_filters], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        cache_key = f"prp:listing_facets:{version}:{key}"
+
+        counts = frappe.cache().get_value(cache_key)
+        if counts is None:
+            rows = frappe.get_list(
+                "PRP Listing",
+                filters=facet_filters,
+                fields=[facet, "count(name) as count"],
+                group_by=facet,
+                order_by=None,
+                limit_page_length=0,
+            )
+            counts = {row[facet]: row["count"] for row in rows if row[facet] not in (None, "")}
+            frappe.cache().set_value(cache_key, counts, expires_in_sec=FACET_CACHE_TTL)
+
+        facets[facet] = counts
+
+    return facets
+
+
+@frappe.whitelist()
+def search_listings(
+    filters=None,
+    min_price=None,
+    max_price=None,
+    start=0,
+    page_length=20,
+    order_by="creation desc",
+    with_facets=1,
+    territory=None,
+):
+    """Get a page of listings matching the selection along with facet counts
+
+    filters: {field: value or [values]} for the facet fields, building and secondhand flags
+    territory: only listings in projects at or under this territory (a city, suburb, ...)
+    """
+    try:
+        parsed_filters = parse_filters(filters)
+        base_filters = get_base_filters(min_price, max_price, territory)
+        all_filters = get_filter_list(parsed_filters, base_filters)
+
+        results = frappe.get_list(
+            "PRP Listing",
+            filters=all_filters,
+            fields=RESULT_FIELDS,
+            order_by=order_by if order_by in ORDER_BY_OPTIONS else "creation desc",
+            start=cint(start),
+            page_length=cint(page_length) or 20,
+        )
+
+        total = frappe.get_list(
+            "PRP Listing", filters=all_filters, fields=["count(name) as total"], order_by=None
+        )[0].total
+
+        return {
+            "success": True,
+            "results": results,
+            "total": total,
+            "facets": get_facet_counts(parsed_filters, base_filters) if cint(with_facets) else None,
+        }
+    except frappe.PermissionError:
+        raise
+    except Exception as e:
+        frappe.log_error(f"Error searching listings: {str(e)}", "PRP Listing Search")
+        return {"success": False, "message": str(e)}
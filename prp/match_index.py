@@ -0,0 +1,307 @@
+"""
+Persisted index of the best matches between leads and listings.
+
+"Lead" rows of PRP Match hold each lead's top listings and "Listing" rows each
+listing's top leads, MATCH_INDEX_SIZE of each at most. When a lead's
+preferences or a listing change, only that side is re-ranked. On the other
+side, its new score is upserted into each entry it suits, evicting the lowest
+row of a full entry. An entry is only re-ranked in full when its row for the
+changed lead or listing dropped or went away while the entry was full.
+
+Deleting a lead drops its rows with it. Rows of deleted listings and
+preferences are left to the queued update, so match rows don't block deletes
+(see ignore_links_on_delete in hooks).
+"""
+
+import frappe
+from frappe.utils import cint, now
+
+from prp.matching import (
+    get_details,
+    get_lead_scores,
+    get_listing_scores,
+    get_match_data,
+    rank_leads_for_listing,
+    rank_listings_for_preferences,
+)
+
+MATCH_INDEX_SIZE = 20
+
+MATCH_INDEX_PENDING_KEY = "prp:match_index_pending"
+MATCH_INDEX_QUEUED_KEY = "prp:match_index_queued"
+
+MATCH_FIELDS = ["name", "creation", "modified", "owner", "modified_by", "match_type", "lead", "preference", "listing", "score"]
+
+
+def enqueue_match_update(lead=None, listing=None):
+    """Queue the index update for a changed lead or listing, coalesced with other pending changes"""
+    cache = frappe.cache()
+    if lead:
+        cache.hset(MATCH_INDEX_PENDING_KEY, f"lead:{lead}", now())
+    if listing:
+        cache.hset(MATCH_INDEX_PENDING_KEY, f"listing:{listing}", now())
+
+    # A queued job picks up everything pending when it starts
+    if cache.get_value(MATCH_INDEX_QUEUED_KEY):
+        return
+
+    cache.set_value(MATCH_INDEX_QUEUED_KEY, 1, expires_in_sec=600)
+    frappe.enqueue(
+        "prp.match_index.process_pending_match_updates",
+        queue="long",
+        enqueue_after_commit=True,
+        now=frappe.flags.in_test,
+    )
+
+
+def process_pending_match_updates():
+    cache = frappe.cache()
+
+    # Clear the flag first so changes from here on queue another job
+    cache.delete_value(MATCH_INDEX_QUEUED_KEY)
+    pending = cache.hgetall(MATCH_INDEX_PENDING_KEY)
+
+    for key in pending:
+        cache.hdel(MATCH_INDEX_PENDING_KEY, key)
+        kind, name = frappe.safe_decode(key).split(":", 1)
+
+        try:
+            if kind == "lead":
+                update_lead_matches(name)
+            else:
+                update_listing_matches(name)
+            if not frappe.flags.in_test:
+                frappe.db.commit()
+        except Exception as e:
+            if not frappe.flags.in_test:
+                frappe.db.rollback()
+            frappe.log_error(f"Error updating matches for {kind} {name}: {str(e)}", "PRP Matching")
+
+
+def insert_matches(rows):
+    """Insert (match_type, lead, preference, listing, score) rows"""
+    if not rows:
+        return
+
+    timestamp = now()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        "PRP Match",
+        MATCH_FIELDS,
+        [[frappe.generate_hash(length=12), timestamp, timestamp, user, user, *row] for row in rows],
+    )
+
+
+def replace_lead_matches(lead):
+    """Rescore a lead against every listing and keep its best listings"""
+    data = get_match_data()
+    preferences = [name for name, owner in zip(data.leads.names, data.leads.lead, strict=True) if owner == lead]
+
+    frappe.db.delete("PRP Match", {"match_type": "Lead", "lead": lead})
+    insert_matches(
+        [
+            ("Lead", lead, None, listing, score)
+            for listing, score in rank_listings_for_preferences(preferences, MATCH_INDEX_SIZE)
+        ]
+    )
+
+
+def replace_listing_matches(listing):
+    """Rescore a listing against every lead and keep its best leads"""
+    frappe.db.delete("PRP Match", {"match_type": "Listing", "listing": listing})
+    insert_matches(
+        [
+            ("Listing", lead, preference, listing, score)
+            for lead, preference, score in rank_leads_for_listing(listing, MATCH_INDEX_SIZE)
+        ]
+    )
+
+
+def get_entry_stats(match_type, field, entries):
+    """Get {entry: (match count, lowest score)} for some entries of one side of the index"""
+    rows = frappe.db.sql(
+        f"""
+        SELECT {field}, COUNT(*), MIN(score)
+        FROM `tabPRP Match`
+        WHERE match_type = %(match_type)s AND {field} IN %(entries)s
+        GROUP BY {field}
+    """,
+        {"match_type": match_type, "entries": tuple(entries)},
+    )
+    return {entry: (count, lowest) for entry, count, lowest in rows}
+
+
+def evict_lowest_match(match_type, field, entry):
+    lowest = frappe.db.sql(
+        f"""
+        SELECT name FROM `tabPRP Match`
+        WHERE match_type = %s AND {field} = %s
+        ORDER BY score ASC, name ASC
+        LIMIT 1
+    """,
+        (match_type, entry),
+    )
+    if lowest:
+        frappe.db.delete("PRP Match", {"name": lowest[0][0]})
+
+
+def update_entries(match_type, changed, scores):
+    """Fold the new scores of a changed lead or listing into the other side of the index
+
+    match_type: the side to update, "Listing" after a lead changed, "Lead" after a listing changed
+    scores: {entry: (score, preference)} of the changed lead or listing against every entry it suits
+
+    The changed pair's row is upserted into each entry, evicting the entry's lowest
+    row when that makes it exceed MATCH_INDEX_SIZE. Only a full entry whose row
+    for the changed side dropped or went away is re-ranked, as a lead or listing
+    outside it may now take that place.
+    """
+    if match_type == "Listing":
+        entry_field, changed_field, replace = "listing", "lead", replace_listing_matches
+    else:
+        entry_field, changed_field, replace = "lead", "listing", replace_lead_matches
+
+    current = {
+        entry: (name, score)
+        for entry, name, score in frappe.db.sql(
+            f"""
+            SELECT {entry_field}, name, score FROM `tabPRP Match`
+            WHERE match_type = %s AND {changed_field} = %s
+        """,
+            (match_type, changed),
+        )
+    }
+
+    candidates = set(current) | set(scores)
+    if not candidates:
+        return
+
+    stats = get_entry_stats(match_type, entry_field, candidates)
+    deletes, updates, inserts, evict, rerank = [], {}, [], [], []
+
+    for entry in candidates:
+        score, preference = scores.get(entry, (0, None))
+        count, lowest = stats.get(entry, (0, 0))
+        full = count >= MATCH_INDEX_SIZE
+
+        if entry in current:
+            name, old_score = current[entry]
+            if full and score < old_score:
+                rerank.append(entry)
+            elif score <= 0:
+                deletes.append(name)
+            else:
+                updates[name] = {"score": score, "preference": preference}
+        elif score > 0 and (not full or score > lowest):
+            inserts.append(
+                (match_type, changed, preference, entry, score)
+                if match_type == "Listing"
+                else (match_type, entry, None, changed, score)
+            )
+            if full:
+                evict.append(entry)
+
+    if deletes:
+        frappe.db.delete("PRP Match", {"name": ["in", deletes]})
+    if updates:
+        frappe.db.bulk_update("PRP Match", updates, chunk_size=500)
+    insert_matches(inserts)
+    for entry in evict:
+        evict_lowest_match(match_type, entry_field, entry)
+    for entry in rerank:
+        replace(entry)
+
+
+def update_lead_matches(lead):
+    """Update the index after a lead's preferences changed"""
+    replace_lead_matches(lead)
+    update_entries("Listing", lead, get_lead_scores(lead))
+
+
+def update_listing_matches(listing):
+    """Update the index after a listing changed or was removed"""
+    replace_listing_matches(listing)
+    update_entries(
+        "Lead",
+        listing,
+        {lead: (round(score, 4), None) for lead, score in get_listing_scores(listing).items()},
+    )
+
+
+def remove_lead_matches(lead):
+    """Drop a deleted lead from the index, refilling the listing entries it leaves a place in"""
+    listings = frappe.get_all(
+        "PRP Match", filters={"match_type": "Listing", "lead": lead}, pluck="listing", distinct=True
+    )
+    frappe.db.delete("PRP Match", {"lead": lead})
+    for listing in listings:
+        enqueue_match_update(listing=listing)
+
+
+@frappe.whitelist()
+def rebuild_match_index():
+    """Rebuild the whole match index"""
+    frappe.only_for("System Manager")
+
+    frappe.enqueue("prp.match_index.build_match_index", queue="long", timeout=3600, enqueue_after_commit=True)
+    return {"success": True, "message": "Rebuilding the match index in the background"}
+
+
+def build_match_index():
+    data = get_match_data()
+
+    frappe.db.delete("PRP Match")
+    for lead in set(data.leads.lead):
+        replace_lead_matches(lead)
+    for listing in data.listings.names:
+        replace_listing_matches(listing)
+
+    frappe.db.commit()
+
+
+def get_indexed_matches(match_type, field, value, limit):
+    return frappe.get_all(
+        "PRP Match",
+        filters={"match_type": match_type, field: value},
+        fields=["lead", "preference", "listing", "score"],
+        order_by="score desc",
+        limit=limit,
+    )
+
+
+@frappe.whitelist()
+def get_lead_matches(lead, limit=MATCH_INDEX_SIZE):
+    """Get the indexed best listings for a lead"""
+    frappe.has_permission("PRP Lead", "read", doc=lead, throw=True)
+
+    matches = get_indexed_matches("Lead", "lead", lead, cint(limit) or MATCH_INDEX_SIZE)
+    details = get_details(
+        "PRP Listing",
+        [match.listing for match in matches],
+        ["name", "unit_id", "building", "project", "bedrooms", "type", "unit_price", "availability"],
+    )
+
+    return {
+        "success": True,
+        "matches": [{**details[match.listing], "score": match.score} for match in matches if match.listing in details],
+    }
+
+
+@frappe.whitelist()
+def get_listing_matches(listing, limit=MATCH_INDEX_SIZE):
+    """Get the indexed best leads for a listing"""
+    frappe.has_permission("PRP Listing", "read", doc=listing, throw=True)
+
+    matches = get_indexed_matches("Listing", "listing", listing, cint(limit) or MATCH_INDEX_SIZE)
+    details = get_details(
+        "PRP Lead", [match.lead for match in matches], ["name", "lead_name", "status", "lead_owner"]
+    )
+
+    return {
+        "success": True,
+        "matches": [
+            {**details[match.lead], "preference": match.preference, "score": match.score}
+            for match in matches
+            if match.lead in details
+        ],
+    }
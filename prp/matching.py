@@ -0,0 +1,412 @@
+"""
+Matching of lead preferences against listings.
+
+Each side is loaded once into column arrays: amenity checks packed into an
+integer bitmask per row, bedrooms and type as small integer codes, sizes as
+floats and territories as codes. A lead is then scored against every listing
+(or a listing against every lead) with a few vectorized NumPy operations.
+
+A lead's territory matches every listing whose project territory lies at or
+under it, resolved once per distinct lead territory through the cached
+territory subtrees.
+
+The arrays are kept per process and rebuilt when the match version, bumped
+after commits that change match fields of listings and preferences, or the
+territory hierarchy moves on.
+"""
+
+import threading
+
+import frappe
+import numpy as np
+from frappe.utils import cint
+
+import prp
+from prp.prp.doctype.prp_territory_closure.prp_territory_closure import (
+    get_cached_descendants,
+    get_subtree_version,
+)
+
+AMENITY_FIELDS = [
+    "gated_community",
+    "pet_friendly",
+    "walkable",
+    "gym",
+    "pool",
+    "sauna",
+    "park",
+    "security",
+    "conceirge",
+    "covered_parking",
+    "ev_stations",
+    "central_ac",
+    "chiller_free",
+    "smart_home",
+    "furnished",
+    "pets_allowed",
+    "balcony",
+    "walkin_closet",
+    "open_kitchen",
+    "kitchen_appliances",
+    "city_view",
+    "sea_view",
+    "garden_view",
+]
+
+AMENITY_BITS = np.left_shift(np.int64(1), np.arange(len(AMENITY_FIELDS), dtype=np.int64))
+
+# Weights of the partial scores, summing to 1
+MATCH_WEIGHTS = {"amenities": 0.5, "size": 0.3, "territory": 0.2}
+
+# Listings more than this far outside a lead's size range score 0 on size
+SIZE_TOLERANCE = 0.25
+
+DEFAULT_MATCH_LIMIT = 20
+
+MATCH_VERSION_KEY = "prp:match_version"
+
+# Fields the match arrays are loaded from, saves changing none of them keep the arrays
+LISTING_MATCH_FIELDS = ("bedrooms", "type", "project", "availability", "listing_amenities")
+PREFERENCE_MATCH_FIELDS = (
+    "lead",
+    "is_listing",
+    "bedrooms",
+    "type",
+    "territory",
+    "sqm",
+    "min_sqm",
+    "max_sqm",
+    *AMENITY_FIELDS,
+)
+
+_match_data = {}
+_match_data_lock = threading.Lock()
+
+
+def get_match_version():
+    version = frappe.cache().get_value(MATCH_VERSION_KEY)
+    if not version:
+        version = frappe.generate_hash(length=10)
+        frappe.cache().set_value(MATCH_VERSION_KEY, version)
+    return version
+
+
+def clear_match_data():
+    """Make every process reload its match arrays on next use, once the transaction commits"""
+    prp.run_after_commit(bump_match_version)
+
+
+def bump_match_version():
+    frappe.cache().set_value(MATCH_VERSION_KEY, frappe.generate_hash(length=10))
+
+
+def match_fields_changed(doc, fields):
+    """Check whether a save changed any of the fields the match arrays are loaded from"""
+    before = doc.get_doc_before_save()
+    return not before or any(doc.get(field) != before.get(field) for field in fields)
+
+
+def get_region_members(regions, territories):
+    """Get a (regions + 1, territory codes + 1) matrix telling which territories lie in each region"""
+    members = np.zeros((len(regions.codes) + 1, len(territories.codes) + 1), dtype=bool)
+    for region, r in regions.codes.items():
+        for territory in get_cached_descendants(region):
+            if territory in territories.codes:
+                members[r, territories.codes[territory]] = True
+    return members
+
+
+class Codes:
+    """Assigns small integer codes to values, 0 standing for "not set" """
+
+    def __init__(self):
+        self.codes = {}
+
+    def __call__(self, value):
+        if not value:
+            return 0
+        return self.codes.setdefault(value, len(self.codes) + 1)
+
+    def get(self, value):
+        # Values never seen on the other side get a code that matches nothing
+        return self.codes.get(value, -1) if value else 0
+
+
+def pack_amenities(rows, offset):
+    """Pack the amenity checks found from `offset` onwards in each row into bitmasks"""
+    if not rows:
+        return np.zeros(0, dtype=np.int64)
+    checks = np.array([row[offset : offset + len(AMENITY_FIELDS)] for row in rows], dtype=np.int64)
+    return (checks != 0).astype(np.int64) @ AMENITY_BITS
+
+
+def popcount(values):
+    """Count the set bits of every value of an int64 array"""
+    bytes_ = np.ascontiguousarray(values, dtype=">i8").view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(bytes_, axis=1).sum(axis=1).reshape(np.shape(values))
+
+
+def load_match_data():
+    amenity_columns = ", ".join(f"pref.`{field}`" for field in AMENITY_FIELDS)
+    bedrooms, types, territories, regions = Codes(), Codes(), Codes(), Codes()
+
+    listings = frappe.db.sql(
+        f"""
+        SELECT
+            l.name, COALESCE(NULLIF(l.bedrooms, ''), pref.bedrooms), COALESCE(NULLIF(l.type, ''), pref.type),
+            project.territory, pref.sqm, {amenity_columns}
+        FROM `tabPRP Listing` l
+        LEFT JOIN `tabPRP Preference` pref ON pref.name = l.listing_amenities
+        LEFT JOIN `tabPRP Project` project ON project.name = l.project
+        WHERE COALESCE(l.availability, '') != 'Sold'
+    """
+    )
+
+    leads = frappe.db.sql(
+        f"""
+        SELECT pref.name, pref.lead, pref.bedrooms, pref.type, pref.territory,
+            pref.min_sqm, pref.max_sqm, {amenity_columns}
+        FROM `tabPRP Preference` pref
+        WHERE COALESCE(pref.lead, '') != '' AND pref.is_listing = 0
+    """
+    )
+
+    return frappe._dict(
+        listings=frappe._dict(
+            names=[row[0] for row in listings],
+            index={row[0]: i for i, row in enumerate(listings)},
+            bedrooms=np.array([bedrooms(row[1]) for row in listings], dtype=np.int32),
+            type=np.array([types(row[2]) for row in listings], dtype=np.int32),
+            territory=np.array([territories(row[3]) for row in listings], dtype=np.int32),
+            sqm=np.array([row[4] or np.nan for row in listings], dtype=np.float64),
+            amenities=pack_amenities(listings, 5),
+        ),
+        leads=frappe._dict(
+            names=[row[0] for row in leads],
+            lead=[row[1] for row in leads],
+            bedrooms=np.array([bedrooms.get(row[2]) for row in leads], dtype=np.int32),
+            type=np.array([types.get(row[3]) for row in leads], dtype=np.int32),
+            region=np.array([regions(row[4]) for row in leads], dtype=np.int32),
+            min_sqm=np.array([row[5] or 0 for row in leads], dtype=np.float64),
+            max_sqm=np.array([row[6] or 0 for row in leads], dtype=np.float64),
+            amenities=pack_amenities(leads, 7),
+        ),
+        territories=territories,
+        region_members=get_region_members(regions, territories),
+    )
+
+
+def get_match_data():
+    """Get the column arrays of both sides, reloading them when the match version moved"""
+    version = (get_match_version(), get_subtree_version())
+    site = frappe.local.site
+
+    with _match_data_lock:
+        cached = _match_data.get(site)
+        if cached and cached[0] == version:
+            return cached[1]
+
+    data = load_match_data()
+    with _match_data_lock:
+        _match_data[site] = (version, data)
+    return data
+
+
+def take(columns, index):
+    """Select rows of every array column, keeping the 2D shape used for broadcasting"""
+    return frappe._dict(
+        {key: value[index] for key, value in columns.items() if isinstance(value, np.ndarray)}
+    )
+
+
+def compute_scores(leads, listings, region_members):
+    """Score lead preferences against listings
+
+    Columns are broadcast against each other, so pass leads as (m, 1) and
+    listings as (1, n) to get an (m, n) matrix. Listings with a different type
+    or bedroom count than the lead asked for score 0.
+    """
+    eligible = ((leads.bedrooms == 0) | (leads.bedrooms == listings.bedrooms)) & (
+        (leads.type == 0) | (leads.type == listings.type)
+    )
+
+    # Share of the lead's amenities the listing has; no amenities asked means a full match
+    wanted = popcount(leads.amenities)
+    shared = popcount(leads.amenities & listings.amenities)
+    amenity_score = np.where(wanted > 0, shared / np.maximum(wanted, 1), 1.0)
+
+    # 1 inside the size range, falling linearly to 0 at SIZE_TOLERANCE outside it
+    sqm = listings.sqm
+    below = np.where(leads.min_sqm > 0, (leads.min_sqm - sqm) / np.maximum(leads.min_sqm, 1), 0)
+    above = np.where(leads.max_sqm > 0, (sqm - leads.max_sqm) / np.maximum(leads.max_sqm, 1), 0)
+    outside = np.maximum(np.maximum(below, above), 0)
+    size_score = np.clip(1 - outside / SIZE_TOLERANCE, 0, 1)
+    # Unknown listing sizes are neither a match nor a mismatch
+    size_score = np.where(np.isnan(sqm), 0.5, size_score)
+
+    # Any listing inside the lead's region matches, a lead without one accepts all
+    territory_score = np.where(leads.region == 0, 1.0, region_members[leads.region, listings.territory])
+
+    score = (
+        MATCH_WEIGHTS["amenities"] * amenity_score
+        + MATCH_WEIGHTS["size"] * size_score
+        + MATCH_WEIGHTS["territory"] * territory_score
+    )
+    return np.where(eligible, score, 0.0)
+
+
+def top_k(scores, limit):
+    """Get the indexes of the highest positive scores, best first"""
+    limit = min(limit, len(scores))
+    if not limit:
+        return []
+
+    index = np.argpartition(-scores, limit - 1)[:limit]
+    index = index[np.argsort(-scores[index], kind="stable")]
+    return [i for i in index if scores[i] > 0]
+
+
+def get_territory_mask(data, territory):
+    """Get which listings lie at or under a territory"""
+    subtree = get_cached_descendants(territory)
+    codes = [code for name, code in data.territories.codes.items() if name in subtree]
+    return np.isin(data.listings.territory, codes)
+
+
+def rank_listings_for_preferences(preferences, limit=DEFAULT_MATCH_LIMIT, territory=None):
+    """Get [(listing, score)] for the best listings across some lead preferences
+
+    territory: only rank listings at or under this territory
+    """
+    data = get_match_data()
+    preferences = set(preferences)
+    rows = [i for i, name in enumerate(data.leads.names) if name in preferences]
+    if not rows or not data.listings.names:
+        return []
+
+    listings = take(data.listings, np.newaxis)
+    scores = compute_scores(take(data.leads, (rows, np.newaxis)), listings, data.region_members).max(axis=0)
+    if territory:
+        scores = np.where(get_territory_mask(data, territory), scores, 0.0)
+
+    return [(data.listings.names[i], round(float(scores[i]), 4)) for i in top_k(scores, limit)]
+
+
+def rank_leads_for_listing(listing, limit=DEFAULT_MATCH_LIMIT):
+    """Get [(lead, preference, score)] for the leads a listing suits best, one row per lead"""
+    data = get_match_data()
+    i = data.listings.index.get(listing)
+    if i is None or not data.leads.names:
+        return []
+
+    scores = compute_scores(take(data.leads, slice(None)), take(data.listings, [i]), data.region_members)
+
+    # Keep the best preference of each lead
+    matches = []
+    seen = set()
+    for j in top_k(scores, len(scores)):
+        lead = data.leads.lead[j]
+        if lead in seen:
+            continue
+        seen.add(lead)
+        matches.append((lead, data.leads.names[j], round(float(scores[j]), 4)))
+        if len(matches) >= limit:
+            break
+
+    return matches
+
+
+def get_lead_scores(lead):
+    """Get {listing: (score, preference)} with the best of a lead's preferences for every listing it suits"""
+    data = get_match_data()
+    rows = [i for i, name in enumerate(data.leads.lead) if name == lead]
+    if not rows or not data.listings.names:
+        return {}
+
+    scores = compute_scores(
+        take(data.leads, (rows, np.newaxis)), take(data.listings, np.newaxis), data.region_members
+    )
+    best = scores.argmax(axis=0)
+    best_scores = scores.max(axis=0)
+
+    return {
+        data.listings.names[i]: (round(float(best_scores[i]), 4), data.leads.names[rows[best[i]]])
+        for i in np.flatnonzero(best_scores > 0)
+    }
+
+
+def get_listing_scores(listing):
+    """Get {lead: score} with the best score of each lead's preferences against a listing"""
+    data = get_match_data()
+    i = data.listings.index.get(listing)
+    if i is None or not data.leads.names:
+        return {}
+
+    scores = compute_scores(take(data.leads, slice(None)), take(data.listings, [i]), data.region_members)
+
+    best = {}
+    for lead, score in zip(data.leads.lead, scores.tolist(), strict=True):
+        if score > best.get(lead, 0):
+            best[lead] = score
+    return best
+
+
+def get_details(doctype, names, fields):
+    """Get the rows the user may read among some documents, keyed by name"""
+    if not names:
+        return {}
+    return {row.name: row for row in frappe.get_list(doctype, filters={"name": ["in", names]}, fields=fields)}
+
+
+@frappe.whitelist()
+def get_matching_listings(lead=None, preference=None, limit=DEFAULT_MATCH_LIMIT, territory=None):
+    """Get the listings that best match a lead's preferences (or a single preference)
+
+    territory: only match listings in projects at or under this territory
+    """
+    try:
+        if preference:
+            preferences = [preference]
+        elif lead:
+            preferences = frappe.get_all(
+                "PRP Preference", filters={"lead": lead, "is_listing": 0}, pluck="name"
+            )
+        else:
+            frappe.throw("Either a lead or a preference is required")
+
+        matches = rank_listings_for_preferences(preferences, cint(limit) or DEFAULT_MATCH_LIMIT, territory)
+        details = get_details(
+            "PRP Listing",
+            [name for name, score in matches],
+            ["name", "unit_id", "building", "project", "bedrooms", "type", "unit_price", "availability"],
+        )
+
+        return {
+            "success": True,
+            "matches": [{**details[name], "score": score} for name, score in matches if name in details],
+        }
+    except Exception as e:
+        frappe.log_error(f"Error matching listings: {str(e)}", "PRP Matching")
+        return {"success": False, "message": str(e)}
+
+
+@frappe.whitelist()
+def get_matching_leads(listing, limit=DEFAULT_MATCH_LIMIT):
+    """Get the leads whose preferences a listing matches best"""
+    try:
+        matches = rank_leads_for_listing(listing, cint(limit) or DEFAULT_MATCH_LIMIT)
+        details = get_details(
+            "PRP Lead", [lead for lead, preference, score in matches], ["name", "lead_name", "status", "lead_owner"]
+        )
+
+        return {
+            "success": True,
+            "matches": [
+                {**details[lead], "preference": preference, "score": score}
+                for lead, preference, score in matches
+                if lead in details
+            ],
+        }
+    except Exception as e:
+        frappe.log_error(f"Error matching leads: {str(e)}", "PRP Matching")
+        return {"success": False, "message": str(e)}
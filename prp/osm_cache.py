@@ -0,0 +1,199 @@
+"""
+Persistent cache of raw Overpass and Nominatim responses.
+
+Responses are stored gzipped under the site's private files, addressed by a hash
+of the request. Entries expire after a per-endpoint TTL and the oldest ones are
+evicted once the cache grows past its size cap.
+
+Site config:
+    prp_osm_offline: serve from the cache only, regardless of age, and never hit the network
+    prp_osm_cache_max_size: size cap in bytes
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import frappe
+import requests
+from frappe.utils import cint
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from prp import rate_limit
+
+OVERPASS_TTL = 30 * 86400
+NOMINATIM_TTL = 7 * 86400
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+# (connect, read) timeouts for OSM requests
+REQUEST_TIMEOUT = (10, 90)
+
+USER_AGENT = "RealEstateCRM/1.0"
+
+_session = None
+
+
+def get_session():
+    """Get the process-wide keep-alive session used for OSM requests"""
+    global _session
+
+    if _session is None:
+        # Back off exponentially on throttling and transient server errors,
+        # honouring Retry-After, for every method (Overpass queries are POSTs)
+        retry = Retry(
+            total=3,
+            backoff_factor=2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["User-Agent"] = USER_AGENT
+        _session = session
+
+    return _session
+
+
+def get_cache_dir():
+    cache_dir = frappe.get_site_path("private", "osm_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def is_offline():
+    return bool(cint(frappe.conf.get("prp_osm_offline")))
+
+
+def get_cache_key(method, url, params=None, data=None):
+    """Hash a request into the key its response is stored under"""
+    request = [method.upper(), url, sorted((params or {}).items()), data or ""]
+    return hashlib.sha256(json.dumps(request, default=str).encode()).hexdigest()
+
+
+def get_cache_path(key):
+    return os.path.join(get_cache_dir(), key[:2], f"{key}.json.gz")
+
+
+def get_cached_path(key, ttl):
+    """Get the path of a cached response if it is still fresh (or we're offline)"""
+    path = get_cache_path(key)
+    if not os.path.exists(path):
+        return None
+
+    if not is_offline() and time.time() - os.path.getmtime(path) > ttl:
+        return None
+
+    return path
+
+
+def fetch(method, url, params=None, data=None, ttl=NOMINATIM_TTL, rate_limit_key=None):
+    """Get the path of the gzipped response body for a request, downloading it on a miss
+
+    The body is streamed straight to disk, so large Overpass responses never need
+    to fit in memory. Returns None if the request fails or we're offline and the
+    response was never cached.
+    """
+    key = get_cache_key(method, url, params, data)
+
+    path = get_cached_path(key, ttl)
+    if path:
+        return path
+
+    if is_offline():
+        frappe.log(f"OSM cache miss in offline mode: {method} {url}")
+        return None
+
+    if rate_limit_key:
+        rate_limit.acquire(rate_limit_key)
+
+    response = get_session().request(
+        method, url, params=params, data=data, timeout=REQUEST_TIMEOUT, stream=True
+    )
+
+    with response:
+        if response.status_code != 200:
+            frappe.log_error(
+                f"OSM request failed with status {response.status_code}: {method} {url}", "OSM Cache"
+            )
+            return None
+
+        path = get_cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial body
+        tmp_path = f"{path}.{frappe.generate_hash(length=8)}.tmp"
+        try:
+            with gzip.open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    enforce_size_cap()
+    return path
+
+
+def open_response(method, url, params=None, data=None, ttl=NOMINATIM_TTL, rate_limit_key=None):
+    """Open the cached response body of a request as a binary stream, or return None"""
+    path = fetch(method, url, params=params, data=data, ttl=ttl, rate_limit_key=rate_limit_key)
+    return gzip.open(path, "rb") if path else None
+
+
+def get_json(method, url, params=None, data=None, ttl=NOMINATIM_TTL, rate_limit_key=None):
+    """Get the parsed JSON response of a request, or None"""
+    f = open_response(method, url, params=params, data=data, ttl=ttl, rate_limit_key=rate_limit_key)
+    if not f:
+        return None
+
+    with f:
+        return json.load(f)
+
+
+def enforce_size_cap():
+    """Evict the oldest responses once the cache is over its size cap"""
+    max_size = cint(frappe.conf.get("prp_osm_cache_max_size")) or DEFAULT_MAX_SIZE
+
+    entries = []
+    total_size = 0
+    for root, _dirs, files in os.walk(get_cache_dir()):
+        for filename in files:
+            if not filename.endswith(".json.gz"):
+                continue
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+    if total_size <= max_size:
+        return
+
+    # Evict down to 90% of the cap so we don't walk the cache on every write
+    for _mtime, size, path in sorted(entries):
+        if total_size <= max_size * 0.9:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+        except FileNotFoundError:
+            continue
+
+
+@frappe.whitelist()
+def clear_osm_cache():
+    """Remove every cached OSM response"""
+    frappe.only_for("System Manager")
+
+    shutil.rmtree(get_cache_dir(), ignore_errors=True)
+    return {"success": True, "message": "OSM cache cleared"}
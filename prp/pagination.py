@@ -0,0 +1,100 @@
+"""
+Keyset pagination for the large PRP lists.
+
+A page is read after the (creation, name) of the last row of the previous page
+instead of at an offset, so every page is a range scan on the (creation, name)
+index however deep it is. Rows sharing a creation timestamp are ordered by
+name, so none are skipped or repeated at a page boundary.
+"""
+
+import frappe
+from frappe.utils import cint
+
+KEYSET_DOCTYPES = ("PRP Lead", "PRP Listing", "PRP Note", "PRP Territory")
+
+MAX_PAGE_LENGTH = 500
+
+
+def get_filter_list(filters):
+    """Turn {field: value or [operator, value]} filters into a list of conditions"""
+    filters = frappe.parse_json(filters) if filters else []
+    if isinstance(filters, dict):
+        return [
+            [field, *(value if isinstance(value, list | tuple) else ["=", value])]
+            for field, value in filters.items()
+        ]
+    return list(filters)
+
+
+def get_keyset_rows(doctype, fields, filters, after, limit, ascending=False):
+    """Get up to limit rows following the (creation, name) cursor `after`"""
+    operator, order = (">", "asc") if ascending else ("<", "desc")
+
+    if not after:
+        return frappe.get_list(
+            doctype, fields=fields, filters=filters, order_by=f"creation {order}, name {order}", limit=limit
+        )
+
+    # Rows created at the same moment as the cursor row, then the ones after it
+    rows = frappe.get_list(
+        doctype,
+        fields=fields,
+        filters=filters + [["creation", "=", after.creation], ["name", operator, after.name]],
+        order_by=f"name {order}",
+        limit=limit,
+    )
+    if len(rows) < limit:
+        rows += frappe.get_list(
+            doctype,
+            fields=fields,
+            filters=filters + [["creation", operator, after.creation]],
+            order_by=f"creation {order}, name {order}",
+            limit=limit - len(rows),
+        )
+    return rows
+
+
+@frappe.whitelist()
+def get_list_page(doctype, fields=None, filters=None, after=None, page_length=20, order="desc", detail="medium"):
+    """Get a page of a large PRP list ordered by (creation, name)
+
+    after: {"creation", "name"} of the last row of the previous page, none for the first page
+    detail: geometry tier served as `geo` for territories, see get_territories
+    """
+    if doctype not in KEYSET_DOCTYPES:
+        frappe.throw(f"Keyset pagination is not available for {doctype}")
+
+    try:
+        if doctype == "PRP Territory":
+            from prp.prp.doctype.prp_territory.prp_territory import get_territory_fields
+
+            fields = get_territory_fields(fields, detail)
+        else:
+            fields = frappe.parse_json(fields) if fields else ["*"]
+            if isinstance(fields, str):
+                fields = [fields]
+
+        # The cursor is taken from the last row
+        if "*" not in fields:
+            fields = list(dict.fromkeys(["name", "creation", *fields]))
+
+        after = frappe._dict(frappe.parse_json(after)) if after else None
+        page_length = min(cint(page_length) or 20, MAX_PAGE_LENGTH)
+
+        rows = get_keyset_rows(
+            doctype, fields, get_filter_list(filters), after, page_length + 1, ascending=order == "asc"
+        )
+        has_more = len(rows) > page_length
+        rows = rows[:page_length]
+
+        return {
+            "success": True,
+            "rows": rows,
+            "has_more": has_more,
+            "next": {"creation": rows[-1].creation, "name": rows[-1].name} if has_more else None,
+        }
+    except frappe.PermissionError:
+        raise
+    except Exception as e:
+        frappe.log_error(f"Error paging {doctype}: {str(e)}", "PRP Pagination")
+        return {"success": False, "message": str(e)}
@@ -0,0 +1,6 @@
+import frappe
+
+
+def execute():
+    # prp.sync.get_changes reads deletions by doctype since a timestamp
+    frappe.db.add_index("Deleted Document", ["deleted_doctype", "creation"])
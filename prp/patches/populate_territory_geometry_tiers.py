@@ -0,0 +1,16 @@
+import frappe
+
+from prp.prp.doctype.prp_territory.prp_territory import get_geometry_tiers
+
+
+def execute():
+    # Precompute the simplified geometries served to list views and maps, one
+    # territory at a time since full resolution boundaries can be large
+    for name in frappe.get_all("PRP Territory", filters={"geo": ["is", "set"]}, pluck="name"):
+        try:
+            tiers = get_geometry_tiers(frappe.db.get_value("PRP Territory", name, "geo"))
+        except Exception as e:
+            frappe.log_error(f"Error simplifying geometry of {name}: {str(e)}", "PRP Territory Geometry")
+            continue
+
+        frappe.db.set_value("PRP Territory", name, tiers, update_modified=False)
@@ -0,0 +1,8 @@
+import frappe
+
+from prp.prp.doctype.prp_territory_closure.prp_territory_closure import rebuild_territory_closure
+
+
+def execute():
+    frappe.reload_doc("prp", "doctype", "prp_territory_closure")
+    rebuild_territory_closure()
@@ -0,0 +1,13 @@
+import frappe
+
+from prp.prp.doctype.prp_territory.prp_territory import rebuild_territory_spatial_index
+
+
+def execute():
+    # Re-derive the covering cells of every territory against the fixed canonical
+    # extent; cells used to depend on whichever territories existed at boot
+    frappe.reload_doc("prp", "doctype", "prp_territory_cell")
+    frappe.reload_doc("prp", "doctype", "prp_territory")
+
+    for name in frappe.get_all("PRP Territory", pluck="name"):
+        rebuild_territory_spatial_index(name)
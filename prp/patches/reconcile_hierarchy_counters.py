@@ -0,0 +1,12 @@
+import frappe
+
+from prp.prp.doctype.prp_listing.prp_listing import reconcile_doctype_counters
+
+
+def execute():
+    # Seed the new building and project counters from the existing listings
+    frappe.reload_doc("prp", "doctype", "prp_building")
+    frappe.reload_doc("prp", "doctype", "prp_project")
+
+    reconcile_doctype_counters("PRP Building", "PRP Listing", "building")
+    reconcile_doctype_counters("PRP Project", "PRP Building", "project")
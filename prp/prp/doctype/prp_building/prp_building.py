@@ -1,9 +1,26 @@
 # Copyright (c) 2025, Yamen Zakhour and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
+from prp.prp.doctype.prp_listing.prp_listing import update_counters
+
 
 class PRPBuilding(Document):
-	pass
+	def on_update(self):
+		if frappe.flags.defer_hierarchy_rollup:
+			return
+
+		before = self.get_doc_before_save()
+		if (
+			not before
+			or self.has_value_changed("project")
+			or self.has_value_changed("availability")
+			or self.has_value_changed("status")
+		):
+			update_counters("PRP Project", before and before.project, before, self.project, self)
+
+	def on_trash(self):
+		if not frappe.flags.defer_hierarchy_rollup:
+			update_counters("PRP Project", self.project, self, None, None)
@@ -1,9 +1,11 @@
 # Copyright (c) 2025, Yamen Zakhour and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 import prp
+from prp.match_index import remove_lead_matches
+from prp.matching import clear_match_data
 
 class PRPLead(Document):
     def before_save(self):
@@ -14,7 +16,14 @@ class PRPLead(Document):
         prp.refetch_resource(self, "doc_update")
 
     def on_trash(self):
-        prp.refetch_resource(self, "list_update")
+        clear_match_data()
+        remove_lead_matches(self.name)
+        prp.refetch_resource(self, "list_update", action="delete")
 
     def after_insert(self):
         prp.refetch_resource(self, "list_update")
+
+
+def on_doctype_update():
+    # Keyset pagination, see prp.pagination
+    frappe.db.add_index("PRP Lead", ["creation", "name"])
@@ -1,8 +1,16 @@
 # Copyright (c) 2025, Yamen Zakhour and contributors
 # For license information, please see license.txt
 
+import time
+
 import frappe
 from frappe.model.document import Document
+from frappe.utils import cint, flt
+
+import prp
+from prp.listing_search import clear_facet_cache
+from prp.match_index import enqueue_match_update
+from prp.matching import LISTING_MATCH_FIELDS, clear_match_data, match_fields_changed
 
 
 class PRPListing(Document):
@@ -18,36 +26,143 @@ class PRPListing(Document):
         
     
     def on_update(self):
-        if self.has_value_changed("availability") or self.has_value_changed("status"):
-            update_hierarchies(self.building)
+        clear_facet_cache()
+
+        matches_changed = match_fields_changed(self, LISTING_MATCH_FIELDS)
+        if matches_changed:
+            clear_match_data()
+
+        if frappe.flags.defer_hierarchy_rollup:
+            return
+
+        if matches_changed:
+            enqueue_match_update(listing=self.name)
+
+        before = self.get_doc_before_save()
+        if (
+            not before
+            or self.has_value_changed("building")
+            or self.has_value_changed("availability")
+            or self.has_value_changed("status")
+        ):
+            update_counters("PRP Building", before and before.building, before, self.building, self)
         # if self.has_value_changed("building") or self.has_value_changed("unit_id"):
         #     new_name = f"{self.building}-{self.unit_id}"
         #     frappe.rename_doc("PRP Listing", self.name, new_name)
 
+    def on_trash(self):
+        clear_facet_cache()
+        clear_match_data()
 
-def get_field_stats(doctype, field, value, count_fields):
-    """
-    Generic function to get stats for any fields
-    count_fields: list of tuples [(field_name, field_value, result_key)]
+        if not frappe.flags.defer_hierarchy_rollup:
+            update_counters("PRP Building", self.building, self, None, None)
+            enqueue_match_update(listing=self.name)
+
+
+def on_doctype_update():
+    # Composite indexes for the faceted listing search and the building rollups
+    frappe.db.add_index("PRP Listing", ["availability", "status", "bedrooms", "type"])
+    frappe.db.add_index("PRP Listing", ["project", "availability", "unit_price"])
+    frappe.db.add_index("PRP Listing", ["developer", "availability", "unit_price"])
+    frappe.db.add_index("PRP Listing", ["building", "availability", "status"])
+    frappe.db.add_index("PRP Listing", ["bedrooms", "unit_price"])
+
+    # Keyset pagination, see prp.pagination
+    frappe.db.add_index("PRP Listing", ["creation", "name"])
+
+
+# Values tallied by the building and project counters: key -> (field, value)
+COUNTED_VALUES = {
+    "sold": ("availability", "Sold"),
+    "secondhand": ("availability", "Available for Secondhand"),
+    "completed": ("status", "Handover Completed"),
+    "due": ("status", "Due for Handover"),
+}
+
+# Doctype holding the counters -> (suffix of its counter fields, parent doctype, parent link field)
+COUNTER_DOCTYPES = {
+    "PRP Building": ("units", "PRP Project", "project"),
+    "PRP Project": ("buildings", None, None),
+}
+
+
+def get_counter_fields(doctype):
+    suffix = COUNTER_DOCTYPES[doctype][0]
+    return {key: f"{key}_{suffix}" for key in ("total", *COUNTED_VALUES)}
+
+
+def get_contribution(row):
+    """Get what a listing (or building) adds to the counters of its parent"""
+    if not row:
+        return {}
+
+    contribution = {"total": 1}
+    for key, (field, value) in COUNTED_VALUES.items():
+        contribution[key] = 1 if row.get(field) == value else 0
+    return contribution
+
+
+def update_counters(doctype, old_parent, old_row, new_parent, new_row):
+    """Move a child's contribution from the counters of its old parent to its new one
+
+    Counters are adjusted in place with relative UPDATEs, so concurrent saves
+    under the same parent don't overwrite each other, and the parent's status is
+    then derived from its counters alone.
     """
-    case_statements = ", ".join(
-        [
-            f"SUM(CASE WHEN {field_name} = '{field_value}' THEN 1 ELSE 0 END) as {result_key}"
-            for field_name, field_value, result_key in count_fields
-        ]
+    old = get_contribution(old_row)
+    new = get_contribution(new_row)
+
+    if old_parent == new_parent:
+        deltas = {old_parent: {key: new.get(key, 0) - old.get(key, 0) for key in old.keys() | new.keys()}}
+    else:
+        deltas = {old_parent: {key: -count for key, count in old.items()}, new_parent: new}
+
+    for parent, delta in deltas.items():
+        if parent and any(delta.values()):
+            apply_counter_deltas(doctype, parent, delta)
+            update_status_from_counters(doctype, parent)
+
+
+def apply_counter_deltas(doctype, name, deltas):
+    fields = get_counter_fields(doctype)
+    assignments = ", ".join(
+        f"`{fields[key]}` = GREATEST(`{fields[key]}` + %({key})s, 0)" for key, delta in deltas.items() if delta
     )
 
-    return frappe.db.sql(
+    frappe.db.sql(
         f"""
-        SELECT 
-            COUNT(*) as total,
-            {case_statements}
-        FROM `tab{doctype}`
-        WHERE {field} = %s
+        UPDATE `tab{doctype}`
+        SET {assignments}
+        WHERE name = %(name)s
     """,
-        value,
-        as_dict=1,
-    )[0]
+        {"name": name, **deltas},
+    )
+
+
+def get_counter_stats(doctype, name):
+    """Get the counters of a building or project as {total, <value>_count} stats"""
+    fields = get_counter_fields(doctype)
+    counters = frappe.db.get_value(doctype, name, list(fields.values()), as_dict=True) or {}
+    return get_stats_from_counters(doctype, counters)
+
+
+def get_stats_from_counters(doctype, counters):
+    fields = get_counter_fields(doctype)
+    stats = frappe._dict(total=cint(counters.get(fields["total"])))
+    for key in COUNTED_VALUES:
+        stats[f"{key}_count"] = cint(counters.get(fields[key]))
+    return stats
+
+
+def update_status_from_counters(doctype, name):
+    stats = get_counter_stats(doctype, name)
+    updates = {
+        "availability": determine_availability(stats),
+        "status": determine_handover_status(stats),
+    }
+
+    # A building's new status moves its contribution on the project counters in turn
+    return update_doc_fields(doctype, name, updates)
 
 
 def determine_availability(stats):
@@ -66,64 +181,203 @@ def determine_handover_status(stats):
 
 def update_doc_fields(doctype, name, updates):
     """
-    Generic function to update multiple fields in a document
+    Generic function to update multiple derived fields in a document
     updates: dict of field:value pairs to update
+
+    Only the changed columns are written, without loading the document or running
+    its hooks. A version entry and a refetch event are still recorded, and a
+    building's new values are carried over to its project's counters.
     """
-    doc = frappe.get_doc(doctype, name)
-    needs_update = False
+    parent_doctype, link_field = COUNTER_DOCTYPES.get(doctype, (None, None, None))[1:]
+    fields = list({"name", *updates, *([link_field] if link_field else [])})
+
+    before = frappe.db.get_value(doctype, name, fields, as_dict=True)
+    if not before:
+        frappe.throw(f"{doctype} {name} not found", frappe.DoesNotExistError)
+
+    changed = {field: value for field, value in updates.items() if before.get(field) != value}
+    doc = frappe._dict({**before, **changed, "doctype": doctype})
+    if not changed:
+        return doc
 
-    for field, value in updates.items():
-        if doc.get(field) != value:
-            doc.set(field, value)
-            needs_update = True
+    frappe.db.set_value(doctype, name, changed)
+    add_version(doctype, name, [(field, before.get(field), value) for field, value in changed.items()])
+    prp.refetch_resource(doc, "doc_update")
 
-    if needs_update:
-        doc.save()
+    if parent_doctype and not frappe.flags.defer_hierarchy_rollup:
+        update_counters(parent_doctype, before.get(link_field), before, doc.get(link_field), doc)
 
     return doc
 
 
-@frappe.whitelist()
-def update_hierarchies(building):
-    # Get all stats in single queries
-    building_stats = get_field_stats(
-        "PRP Listing",
-        "building",
-        building,
-        [
-            ("availability", "Sold", "sold_count"),
-            ("availability", "Available for Secondhand", "secondhand_count"),
-            ("status", "Handover Completed", "completed_count"),
-            ("status", "Due for Handover", "due_count"),
-        ],
+def add_version(doctype, name, changed):
+    """Record a version entry for fields written outside of a document save"""
+    if not frappe.get_meta(doctype).track_changes:
+        return
+
+    frappe.get_doc(
+        {
+            "doctype": "Version",
+            "ref_doctype": doctype,
+            "docname": name,
+            "data": frappe.as_json({"changed": changed, "added": [], "removed": [], "row_changed": []}),
+        }
+    ).insert(ignore_permissions=True)
+
+
+def get_counter_totals(doctype, child_doctype, link_field, names=None):
+    """Count the children of buildings or projects (all of them by default) from scratch, keyed by name"""
+    fields = get_counter_fields(doctype)
+    case_statements = ", ".join(
+        f"SUM(CASE WHEN child.{field} = %({key})s THEN 1 ELSE 0 END) as {fields[key]}"
+        for key, (field, value) in COUNTED_VALUES.items()
+    )
+
+    rows = frappe.db.sql(
+        f"""
+        SELECT
+            parent.name,
+            COUNT(child.name) as {fields["total"]},
+            {case_statements}
+        FROM `tab{doctype}` parent
+        LEFT JOIN `tab{child_doctype}` child ON child.{link_field} = parent.name
+        {"WHERE parent.name IN %(names)s" if names is not None else ""}
+        GROUP BY parent.name
+    """,
+        {"names": tuple(names or ("",)), **{key: value for key, (field, value) in COUNTED_VALUES.items()}},
+        as_dict=1,
     )
 
-    # Determine new states for building
-    building_updates = {
-        "availability": determine_availability(building_stats),
-        "status": determine_handover_status(building_stats),
+    return {row.name: {field: cint(row[field]) for field in fields.values()} for row in rows}
+
+
+def reconcile_doctype_counters(doctype, child_doctype, link_field, names=None):
+    """Overwrite drifted counters with fresh counts and refresh the affected statuses"""
+    fields = list(get_counter_fields(doctype).values())
+    stored = {
+        row.name: {field: cint(row[field]) for field in fields}
+        for row in frappe.get_all(
+            doctype, filters={"name": ["in", names]} if names is not None else None, fields=["name", *fields]
+        )
     }
 
-    # Update building and get project reference
-    building_doc = update_doc_fields("PRP Building", building, building_updates)
-
-    # Get project stats
-    project_stats = get_field_stats(
-        "PRP Building",
-        "project",
-        building_doc.project,
-        [
-            ("availability", "Sold", "sold_count"),
-            ("availability", "Available for Secondhand", "secondhand_count"),
-            ("status", "Handover Completed", "completed_count"),
-            ("status", "Due for Handover", "due_count"),
-        ],
+    changed = []
+    for name, counters in get_counter_totals(doctype, child_doctype, link_field, names).items():
+        if stored.get(name) != counters:
+            frappe.db.set_value(doctype, name, counters, update_modified=False)
+            update_status_from_counters(doctype, name)
+            changed.append(name)
+
+    return changed
+
+
+def rollup_hierarchies(buildings):
+    """Recount a set of buildings and then their projects with set-based queries
+
+    Used after bulk changes made with `frappe.flags.defer_hierarchy_rollup` set,
+    which skips the per-listing counter updates.
+    """
+    buildings = list({b for b in buildings if b})
+    if not buildings:
+        return {"buildings": [], "projects": []}
+
+    # Every touched project is recounted below, so building updates needn't move its counters
+    defer_hierarchy_rollup = frappe.flags.defer_hierarchy_rollup
+    frappe.flags.defer_hierarchy_rollup = True
+    try:
+        changed_buildings = reconcile_doctype_counters("PRP Building", "PRP Listing", "building", buildings)
+    finally:
+        frappe.flags.defer_hierarchy_rollup = defer_hierarchy_rollup
+
+    projects = frappe.get_all(
+        "PRP Building", filters={"name": ["in", buildings]}, pluck="project", distinct=True
     )
+    changed_projects = reconcile_doctype_counters("PRP Project", "PRP Building", "project", projects)
 
-    # Determine and update project states
-    project_updates = {
-        "availability": determine_availability(project_stats),
-        "status": determine_handover_status(project_stats),
+    return {"buildings": changed_buildings, "projects": changed_projects}
+
+
+@frappe.whitelist()
+def reconcile_hierarchy_counters():
+    """Recompute building and project counters from their listings to correct any drift"""
+    frappe.only_for("System Manager")
+
+    try:
+        # Buildings first: refreshing their statuses moves the project counters,
+        # which are then recounted from the corrected buildings
+        buildings = reconcile_doctype_counters("PRP Building", "PRP Listing", "building")
+        projects = reconcile_doctype_counters("PRP Project", "PRP Building", "project")
+
+        return {
+            "success": True,
+            "message": f"Corrected counters of {len(buildings)} buildings and {len(projects)} projects",
+            "buildings": buildings,
+            "projects": projects,
+        }
+    except Exception as e:
+        frappe.log_error(f"Error reconciling hierarchy counters: {str(e)}", "PRP Listing")
+        return {"success": False, "message": str(e)}
+
+
+def recompute_doctype_hierarchy(doctype, child_doctype, link_field):
+    """Derive counters, availability and status of every building or project in bulk
+
+    Returns the number of rows whose values changed; only those are written.
+    """
+    fields = list(get_counter_fields(doctype).values())
+    current = {
+        row.name: row for row in frappe.get_all(doctype, fields=["name", "availability", "status", *fields])
     }
 
-    update_doc_fields("PRP Project", building_doc.project, project_updates)
+    updates = {}
+    for name, counters in get_counter_totals(doctype, child_doctype, link_field).items():
+        stats = get_stats_from_counters(doctype, counters)
+        values = {
+            **counters,
+            "availability": determine_availability(stats),
+            "status": determine_handover_status(stats),
+        }
+
+        row = current.get(name, {})
+        if any(cint(row.get(f)) != values[f] for f in fields) or any(
+            row.get(f) != values[f] for f in ("availability", "status")
+        ):
+            updates[name] = values
+
+    if updates:
+        frappe.db.bulk_update(doctype, updates, chunk_size=500)
+
+    return len(updates)
+
+
+@frappe.whitelist()
+def recompute_all_hierarchies():
+    """Recompute the counters and statuses of every building and project with set-based queries"""
+    frappe.only_for("System Manager")
+
+    try:
+        timings = {}
+
+        # Buildings first, projects are derived from the updated buildings
+        start = time.monotonic()
+        buildings = recompute_doctype_hierarchy("PRP Building", "PRP Listing", "building")
+        timings["buildings"] = flt(time.monotonic() - start, 3)
+
+        start = time.monotonic()
+        projects = recompute_doctype_hierarchy("PRP Project", "PRP Building", "project")
+        timings["projects"] = flt(time.monotonic() - start, 3)
+
+        for doctype, changed in (("PRP Building", buildings), ("PRP Project", projects)):
+            if changed:
+                prp.refetch_resource(frappe._dict(doctype=doctype, name=None), "list_update")
+
+        return {
+            "success": True,
+            "message": f"Updated {buildings} buildings and {projects} projects in {sum(timings.values()):.2f}s",
+            "buildings_updated": buildings,
+            "projects_updated": projects,
+            "timings": timings,
+        }
+    except Exception as e:
+        frappe.log_error(f"Error recomputing hierarchies: {str(e)}", "PRP Listing")
+        return {"success": False, "message": str(e)}
@@ -0,0 +1,14 @@
+# Copyright (c) 2025, Yamen Zakhour and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class PRPMatch(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("PRP Match", ["match_type", "lead", "score"])
+	frappe.db.add_index("PRP Match", ["match_type", "listing", "score"])
@@ -0,0 +1,158 @@
+# Copyright (c) 2025, Yamen Zakhour and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests import IntegrationTestCase, UnitTestCase
+
+from prp.match_index import (
+	replace_lead_matches,
+	replace_listing_matches,
+	update_lead_matches,
+	update_listing_matches,
+)
+from prp.matching import bump_match_version
+
+# On IntegrationTestCase, the doctype test records and all
+# link-field test record dependencies are recursively loaded
+# Use these module variables to add/remove to/from that list
+EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+
+
+class UnitTestPRPMatch(UnitTestCase):
+	"""
+	Unit tests for PRPMatch.
+	Use this class for testing individual functions and methods.
+	"""
+
+	pass
+
+
+TEST_LEADS = ("_Test Match Lead A", "_Test Match Lead B", "_Test Match Lead C")
+TEST_LISTINGS = ("_Test Match Flat", "_Test Match Villa")
+
+
+class IntegrationTestPRPMatch(IntegrationTestCase):
+	"""
+	Integration tests for PRPMatch.
+	Use this class for testing interactions between multiple components.
+	"""
+
+	def setUp(self):
+		# Inserted without hooks, the index is built below
+		for name, bedrooms, listing_type in (
+			("_Test Match Flat", "2-BR", "Flat"),
+			("_Test Match Villa", "3-BR", "Villa"),
+		):
+			frappe.get_doc(
+				{"doctype": "PRP Listing", "name": name, "bedrooms": bedrooms, "type": listing_type}
+			).db_insert()
+
+		for lead in TEST_LEADS:
+			frappe.get_doc({"doctype": "PRP Lead", "name": lead}).db_insert()
+
+		for lead, bedrooms, preference_type in (
+			("_Test Match Lead A", "2-BR", "Flat"),
+			("_Test Match Lead B", "3-BR", "Villa"),
+			("_Test Match Lead C", "2-BR", "Flat"),
+		):
+			frappe.get_doc(
+				{
+					"doctype": "PRP Preference",
+					"name": f"{lead} Preference",
+					"lead": lead,
+					"bedrooms": bedrooms,
+					"type": preference_type,
+				}
+			).db_insert()
+
+		bump_match_version()
+		for lead in TEST_LEADS:
+			replace_lead_matches(lead)
+		for listing in TEST_LISTINGS:
+			replace_listing_matches(listing)
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def get_matches(self):
+		"""Get {(match_type, lead, listing): (row name, score)} for the test leads and listings"""
+		rows = frappe.get_all(
+			"PRP Match",
+			filters={"lead": ["in", TEST_LEADS], "listing": ["in", TEST_LISTINGS]},
+			fields=["name", "match_type", "lead", "listing", "score"],
+		)
+		return {(row.match_type, row.lead, row.listing): (row.name, row.score) for row in rows}
+
+	def test_initial_index(self):
+		self.assertEqual(
+			set(self.get_matches()),
+			{
+				("Lead", "_Test Match Lead A", "_Test Match Flat"),
+				("Lead", "_Test Match Lead B", "_Test Match Villa"),
+				("Lead", "_Test Match Lead C", "_Test Match Flat"),
+				("Listing", "_Test Match Lead A", "_Test Match Flat"),
+				("Listing", "_Test Match Lead B", "_Test Match Villa"),
+				("Listing", "_Test Match Lead C", "_Test Match Flat"),
+			},
+		)
+
+	def test_preference_change_updates_affected_entries(self):
+		before = self.get_matches()
+
+		frappe.db.set_value(
+			"PRP Preference", "_Test Match Lead A Preference", {"bedrooms": "3-BR", "type": "Villa"}
+		)
+		bump_match_version()
+		update_lead_matches("_Test Match Lead A")
+
+		after = self.get_matches()
+
+		# Lead A moved from the flat to the villa, on both sides of the index
+		self.assertNotIn(("Lead", "_Test Match Lead A", "_Test Match Flat"), after)
+		self.assertNotIn(("Listing", "_Test Match Lead A", "_Test Match Flat"), after)
+		self.assertIn(("Lead", "_Test Match Lead A", "_Test Match Villa"), after)
+		self.assertIn(("Listing", "_Test Match Lead A", "_Test Match Villa"), after)
+
+		# Every other row is the same row with the same score
+		unchanged = {key: value for key, value in before.items() if key[1] != "_Test Match Lead A"}
+		self.assertEqual(
+			{key: value for key, value in after.items() if key[1] != "_Test Match Lead A"}, unchanged
+		)
+
+	def run_queued_update(self, lead=None, listing=None):
+		# Tests run the queued update right away, before the deletion it follows is done
+		bump_match_version()
+		if lead:
+			update_lead_matches(lead)
+		if listing:
+			update_listing_matches(listing)
+
+	def test_delete_matched_listing(self):
+		frappe.delete_doc("PRP Listing", "_Test Match Flat")
+		self.run_queued_update(listing="_Test Match Flat")
+
+		self.assertEqual(
+			set(self.get_matches()),
+			{
+				("Lead", "_Test Match Lead B", "_Test Match Villa"),
+				("Listing", "_Test Match Lead B", "_Test Match Villa"),
+			},
+		)
+
+	def test_delete_matched_preference(self):
+		frappe.delete_doc("PRP Preference", "_Test Match Lead A Preference")
+		self.run_queued_update(lead="_Test Match Lead A")
+
+		self.assertFalse([key for key in self.get_matches() if key[1] == "_Test Match Lead A"])
+		self.assertIn(("Listing", "_Test Match Lead C", "_Test Match Flat"), self.get_matches())
+
+	def test_delete_matched_lead(self):
+		# The lead's rows are still indexed when it goes, its preference update not having run yet
+		frappe.delete_doc("PRP Preference", "_Test Match Lead B Preference")
+		self.assertIn(("Lead", "_Test Match Lead B", "_Test Match Villa"), self.get_matches())
+
+		frappe.delete_doc("PRP Lead", "_Test Match Lead B")
+
+		self.assertFalse([key for key in self.get_matches() if key[1] == "_Test Match Lead B"])
+		self.assertFalse(frappe.db.exists("PRP Match", {"lead": "_Test Match Lead B"}))
@@ -1,9 +1,14 @@
 # Copyright (c) 2025, Yamen Zakhour and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class PRPNote(Document):
 	pass
+
+
+def on_doctype_update():
+	# Keyset pagination, see prp.pagination
+	frappe.db.add_index("PRP Note", ["creation", "name"])
@@ -5,6 +5,8 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import flt
 import prp
+from prp.match_index import enqueue_match_update
+from prp.matching import PREFERENCE_MATCH_FIELDS, clear_match_data, match_fields_changed
 
 class PRPPreference(Document):
     def before_save(self):
@@ -28,10 +30,26 @@ class PRPPreference(Document):
             self.sqm = flt(sqft) / 10.7639
 
     def on_update(self):
+        if match_fields_changed(self, PREFERENCE_MATCH_FIELDS):
+            clear_match_data()
+            self.update_match_index()
         prp.refetch_resource(self, "doc_update")
 
     def on_trash(self):
-        prp.refetch_resource(self, "list_update")
+        clear_match_data()
+        self.update_match_index()
+        prp.refetch_resource(self, "list_update", action="delete")
+
+    def update_match_index(self):
+        """Queue a rescore of whoever this preference belongs to"""
+        before = self.get_doc_before_save()
+        for lead in {self.lead, before and before.lead}:
+            if lead:
+                enqueue_match_update(lead=lead)
+
+        if self.is_listing:
+            for listing in frappe.get_all("PRP Listing", filters={"listing_amenities": self.name}, pluck="name"):
+                enqueue_match_update(listing=listing)
 
     def before_insert(self):
         prp.refetch_resource(self, "list_update")
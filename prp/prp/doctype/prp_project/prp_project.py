@@ -4,30 +4,40 @@
 import frappe
 from frappe.model.document import Document
 
+from prp.matching import clear_match_data
+from prp.prp.doctype.prp_territory.prp_territory import get_territory_ancestry
+
 
 class PRPProject(Document):
 
     def validate(self):
         if self.territory:
-            territory_doc = frappe.get_doc("PRP Territory", self.territory)
-            if territory_doc.is_phase:
+            # The territory and its ancestors, nearest first, read without their geometry
+            ancestry = get_territory_ancestry(self.territory)
+            if not ancestry:
+                frappe.throw(f"Territory {self.territory} not found", frappe.DoesNotExistError)
+            territory = ancestry[0]
+
+            if territory.is_phase:
                 self.is_phase = 1
-                if territory_doc.parent_territory:
+                if territory.parent_territory:
                     parent_project_name = frappe.get_value(
-                        "PRP Project", {"territory": territory_doc.parent_territory}, "name"
+                        "PRP Project", {"territory": territory.parent_territory}, "name"
                     )
                     self.parent_project = parent_project_name
-                    project_doc = frappe.get_doc("PRP Project", parent_project_name)
-                    self.town = project_doc.town
-                    self.suburb = project_doc.suburb
-                    self.city = project_doc.city
-            if territory_doc.parent_territory and not territory_doc.is_phase:
-                town_doc = frappe.get_doc("PRP Territory", territory_doc.parent_territory)
-                self.town = town_doc.name_en
-                if town_doc.parent_territory:
-                    suburb_doc = frappe.get_doc("PRP Territory", town_doc.parent_territory)
-                    self.suburb = suburb_doc.name_en
-                    if suburb_doc.parent_territory:
-                        city_doc = frappe.get_doc("PRP Territory", suburb_doc.parent_territory)
-                        self.city = city_doc.name_en
-                    
\ No newline at end of file
+                    if parent_project_name:
+                        parent_project = frappe.get_value(
+                            "PRP Project", parent_project_name, ["town", "suburb", "city"], as_dict=True
+                        )
+                        self.town = parent_project.town
+                        self.suburb = parent_project.suburb
+                        self.city = parent_project.city
+            if territory.parent_territory and not territory.is_phase:
+                # Town, suburb and city are the next three levels up
+                for field, ancestor in zip(("town", "suburb", "city"), ancestry[1:], strict=False):
+                    self.set(field, ancestor.name_en)
+
+    def on_update(self):
+        # Listings are matched on their project's territory
+        if self.has_value_changed("territory"):
+            clear_match_data()
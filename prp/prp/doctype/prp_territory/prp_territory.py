@@ -1,11 +1,28 @@
 import frappe
+import ijson
 import json
-import requests
-import time
+import math
+import os
+import shapely
+import threading
+import numpy as np
+import prp
+from array import array
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from frappe.model.document import Document
-from shapely.geometry import shape, Point, Polygon, MultiPolygon, mapping
+from prp import osm_cache
+from prp.prp.doctype.prp_territory_closure.prp_territory_closure import (
+    get_ancestors,
+    get_descendants,
+    remove_territory,
+    set_territory_parents,
+)
+from shapely.geometry import shape, box, LineString, Point, Polygon, MultiPolygon, mapping
 from shapely.ops import unary_union
-from frappe.utils import flt, cint, get_datetime, now
+from shapely.prepared import prep
+from frappe.utils import flt, cint, get_datetime, now, now_datetime, time_diff_in_seconds
 
 # Utility functions for geometry processing
 
@@ -49,21 +66,6 @@ def calculate_bounds(geometry):
         return None
 
 
-def verify_geometry_within(child_geometry, parent_geometry):
-    """Verify if a geometry is completely within another geometry"""
-    try:
-        child_shape = shape(child_geometry)
-        parent_shape = shape(parent_geometry)
-
-        # Check if child is within parent
-        return parent_shape.contains(child_shape)
-    except Exception as e:
-        frappe.log_error(
-            f"Error verifying geometry containment: {str(e)}", "Territory Geometry"
-        )
-        return False
-
-
 def calculate_overlap_percentage(geom1, geom2):
     """Calculate what percentage of geom1 is contained within geom2"""
     try:
@@ -87,6 +89,230 @@ def calculate_overlap_percentage(geom1, geom2):
         return 0
 
 
+# Territory geometry cache
+
+# Upper bound on the total number of coordinates held by the geometry cache
+GEOMETRY_CACHE_MAX_COORDINATES = 2_000_000
+GEOMETRY_CACHE_MAX_ENTRIES = 1024
+
+
+class GeometryCache:
+    """Process-level LRU of parsed territory geometries keyed by (name, modified)
+
+    Entries are evicted least recently used first once either the entry count or
+    the total coordinate count goes over its limit. A newer `modified` for the
+    same territory replaces the old entry.
+    """
+
+    def __init__(self, max_coordinates=GEOMETRY_CACHE_MAX_COORDINATES, max_entries=GEOMETRY_CACHE_MAX_ENTRIES):
+        self.max_coordinates = max_coordinates
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # name -> (modified, geometry, prepared, size)
+        self.coordinates = 0
+        self.lock = threading.Lock()
+
+    def get(self, name, modified, geo=None):
+        """Get the geometry of a territory, parsing `geo` (or loading it) on a miss"""
+        return self.get_entry(name, modified, geo)[1]
+
+    def get_prepared(self, name, modified, geo=None):
+        """Get the prepared geometry of a territory for repeated predicate tests"""
+        entry = self.get_entry(name, modified, geo)
+        if entry[2] is None:
+            entry = self.put(name, modified, entry[1], prepared=prep(entry[1]))
+        return entry[2]
+
+    def get_many(self, territories):
+        """Get geometries for rows carrying `name` and `modified`, loading misses in one query"""
+        with self.lock:
+            missing = [t.name for t in territories if not self.lookup(t.name, t.modified)]
+
+        geo_by_name = {}
+        if missing:
+            geo_by_name = dict(
+                frappe.get_all(
+                    "PRP Territory", filters={"name": ["in", missing]}, fields=["name", "geo"], as_list=True
+                )
+            )
+
+        return {t.name: self.get(t.name, t.modified, geo_by_name.get(t.name)) for t in territories}
+
+    def get_entry(self, name, modified, geo=None):
+        with self.lock:
+            entry = self.lookup(name, modified)
+        if entry:
+            return entry
+
+        if geo is None:
+            geo = frappe.db.get_value("PRP Territory", name, "geo")
+
+        geometry = shape(json.loads(geo) if isinstance(geo, str) else geo)
+        if not geometry.is_valid:
+            geometry = geometry.buffer(0)
+
+        return self.put(name, modified, geometry)
+
+    def lookup(self, name, modified):
+        entry = self.entries.get(name)
+        if not entry or entry[0] != str(modified):
+            return None
+        self.entries.move_to_end(name)
+        return entry
+
+    def put(self, name, modified, geometry, prepared=None):
+        entry = (str(modified), geometry, prepared, shapely.get_num_coordinates(geometry))
+
+        with self.lock:
+            self.discard(name)
+            self.entries[name] = entry
+            self.coordinates += entry[3]
+
+            while len(self.entries) > 1 and (
+                len(self.entries) > self.max_entries or self.coordinates > self.max_coordinates
+            ):
+                self.discard(next(iter(self.entries)))
+
+        return entry
+
+    def discard(self, name):
+        entry = self.entries.pop(name, None)
+        if entry:
+            self.coordinates -= entry[3]
+
+    def invalidate(self, name):
+        with self.lock:
+            self.discard(name)
+
+
+geometry_cache = GeometryCache()
+
+
+# Simplified geometry tiers
+
+# detail -> (field, simplification tolerance in degrees, decimals kept)
+# 0.01° is roughly 1km, enough for a country-wide map or a list thumbnail
+GEOMETRY_DETAIL_LEVELS = {
+    "low": ("geo_low", 0.01, 3),
+    "medium": ("geo_medium", 0.001, 4),
+    "high": ("geo_high", 0.0001, 5),
+    "full": ("geo", None, None),
+}
+
+GEOMETRY_TIER_FIELDS = [field for field, tolerance, decimals in GEOMETRY_DETAIL_LEVELS.values() if tolerance]
+
+# Fields returned by get_territories when none are requested
+TERRITORY_LIST_FIELDS = [
+    "name",
+    "osm_id",
+    "territory_name",
+    "name_en",
+    "name_ar",
+    "parent_territory",
+    "is_project",
+    "is_phase",
+    "is_custom",
+    "admin_level",
+    "place",
+    "lat",
+    "lng",
+    "min_lng",
+    "min_lat",
+    "max_lng",
+    "max_lat",
+    "modified",
+]
+
+
+def simplify_geometry(geometry, tolerance, decimals):
+    """Simplify a geometry for display, keeping it valid and non-empty"""
+    simplified = geometry.simplify(tolerance, preserve_topology=True)
+
+    # Polygons much smaller than the tolerance collapse; keep the original shape
+    if simplified.is_empty or not simplified.is_valid:
+        simplified = geometry
+
+    return shapely.transform(simplified, lambda coords: np.round(coords, decimals))
+
+
+def get_geometry_tiers(geo):
+    """Get the simplified GeoJSON of every tier field for a full resolution GeoJSON"""
+    geometry = shape(json.loads(geo) if isinstance(geo, str) else geo)
+    if not geometry.is_valid:
+        geometry = geometry.buffer(0)
+
+    return {
+        field: json.dumps(mapping(simplify_geometry(geometry, tolerance, decimals)))
+        for field, tolerance, decimals in GEOMETRY_DETAIL_LEVELS.values()
+        if tolerance
+    }
+
+
+def get_geometry_field(detail):
+    if detail not in GEOMETRY_DETAIL_LEVELS:
+        frappe.throw(f"Invalid geometry detail {detail}, expected one of {', '.join(GEOMETRY_DETAIL_LEVELS)}")
+    return GEOMETRY_DETAIL_LEVELS[detail][0]
+
+
+def get_territory_fields(fields=None, detail="medium"):
+    """Get the columns to select for a territory list, serving `geo` from the `detail` tier"""
+    fields = frappe.parse_json(fields) if fields else TERRITORY_LIST_FIELDS
+    if isinstance(fields, str):
+        fields = [fields]
+
+    # Never expand into every geometry column
+    if "*" in fields:
+        fields = [
+            f
+            for f in frappe.get_meta("PRP Territory").get_valid_columns()
+            if f not in ("geo", *GEOMETRY_TIER_FIELDS)
+        ]
+
+    fields = [f for f in fields if f not in GEOMETRY_TIER_FIELDS]
+    geo_field = get_geometry_field(detail)
+    if "geo" in fields:
+        fields = [f"{geo_field} as geo" if f == "geo" else f for f in fields]
+    return fields
+
+
+@frappe.whitelist()
+def get_territories(
+    fields=None, filters=None, order_by="name_en asc", start=0, page_length=20, detail="medium", **kwargs
+):
+    """List territories with their geometry at the requested level of detail
+
+    Takes the same arguments as frappe.client.get_list so list resources can point
+    at it. Geometry is only returned when `geo` is among the requested fields, in
+    which case it holds the `detail` tier ("low", "medium", "high" or "full").
+    """
+    return frappe.get_list(
+        "PRP Territory",
+        fields=get_territory_fields(fields, detail),
+        filters=frappe.parse_json(filters) if filters else None,
+        order_by=order_by,
+        start=cint(start),
+        page_length=cint(page_length),
+    )
+
+
+@frappe.whitelist()
+def get_territory_geometries(names, detail="medium"):
+    """Get the geometry of several territories at the requested level of detail, keyed by name"""
+    names = frappe.parse_json(names)
+    if isinstance(names, str):
+        names = [names]
+
+    geo_field = get_geometry_field(detail)
+    return dict(
+        frappe.get_list(
+            "PRP Territory",
+            filters={"name": ["in", names]},
+            fields=["name", f"{geo_field} as geo"],
+            as_list=True,
+            limit_page_length=0,
+        )
+    )
+
+
 # OSM Data Fetching functions
 
 
@@ -110,19 +336,20 @@ def fetch_osm_data(osm_id):
            {osm_type}({id_value});
            (._;>;);
            out body;
-           out skel qt;
        """
 
-        response = requests.post(overpass_url, data=overpass_query)
-        if response.status_code != 200:
-            frappe.log_error(
-                f"Failed to fetch OSM data. Status code: {response.status_code}",
-                "OSM Fetch",
-            )
+        # Parse the cached response as a stream instead of loading it whole
+        response = osm_cache.open_response(
+            "POST", overpass_url, data=overpass_query, ttl=osm_cache.OVERPASS_TTL, rate_limit_key="overpass"
+        )
+        if response is None:
+            frappe.log_error(f"Failed to fetch OSM data for {osm_type}/{id_value}", "OSM Fetch")
             return None
 
-        osm_data = response.json()
-        return process_osm_data(osm_data, osm_type, id_value)
+        with response:
+            return assemble_osm_elements(
+                ijson.items(response, "elements.item", use_float=True), osm_type, id_value
+            )
 
     except Exception as e:
         frappe.log_error(f"Error in fetch_osm_data: {str(e)}", "OSM Fetch")
@@ -131,17 +358,39 @@ def fetch_osm_data(osm_id):
 
 def process_osm_data(osm_data, osm_type, osm_id):
     """Process OSM data into a structured format with geometry"""
+    return assemble_osm_elements(iter(osm_data.get("elements") or []), osm_type, osm_id)
+
+
+def assemble_osm_elements(elements, osm_type, osm_id):
+    """Assemble a structured territory with geometry from a single pass over OSM elements
+
+    Node coordinates and way node references are kept in flat typed arrays rather
+    than per-element dicts, so memory stays proportional to the raw coordinates
+    even for country-sized relations.
+    """
     try:
-        if not osm_data.get("elements"):
+        node_ids = array("q")
+        node_coords = array("d")  # lon, lat pairs
+        ways = {}
+        main_element = None
+
+        for element in elements:
+            element_type = element.get("type")
+            if element_type == "node":
+                node_ids.append(element["id"])
+                node_coords.extend((element["lon"], element["lat"]))
+            elif element_type == "way":
+                ways[element["id"]] = array("q", element.get("nodes", []))
+
+            if element_type == osm_type and str(element["id"]) == str(osm_id):
+                main_element = element
+
+        if not node_ids:
             frappe.log_error(
                 f"No elements found for OSM ID: {osm_id}", "OSM Processing"
             )
             return None
 
-        # Find the main element
-        main_element = next(
-            (e for e in osm_data["elements"] if str(e["id"]) == osm_id), None
-        )
         if not main_element:
             frappe.log_error(
                 f"Main element not found for OSM ID: {osm_id}", "OSM Processing"
@@ -163,139 +412,86 @@ def process_osm_data(osm_data, osm_type, osm_id):
             "residential": tags.get("residential", ""),
         }
 
+        # Sort nodes once so way references resolve with a vectorized binary search
+        ids = np.frombuffer(node_ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        ids = ids[order]
+        coords = np.frombuffer(node_coords, dtype=np.float64).reshape(-1, 2)[order]
+        del node_ids, node_coords
+
+        def resolve(refs):
+            """Get the coordinates of the referenced nodes that are present"""
+            refs = np.frombuffer(refs, dtype=np.int64)
+            positions = np.minimum(np.searchsorted(ids, refs), len(ids) - 1)
+            return coords[positions[ids[positions] == refs]]
+
         # Process geometry based on OSM type
         if osm_type == "node":
-            geometry = {
-                "type": "Point",
-                "coordinates": [
-                    flt(main_element.get("lon")),
-                    flt(main_element.get("lat")),
-                ],
-            }
-            result.update(
-                {
-                    "lat": flt(main_element.get("lat")),
-                    "lng": flt(main_element.get("lon")),
-                    "min_lat": flt(main_element.get("lat")),
-                    "max_lat": flt(main_element.get("lat")),
-                    "min_lng": flt(main_element.get("lon")),
-                    "max_lng": flt(main_element.get("lon")),
-                }
-            )
+            geometry = Point(main_element["lon"], main_element["lat"])
+            outline = np.array([[main_element["lon"], main_element["lat"]]])
 
         elif osm_type == "way":
-            nodes = {n["id"]: n for n in osm_data["elements"] if n["type"] == "node"}
-            coordinates = []
-            for nd_ref in main_element.get("nodes", []):
-                if nd_ref in nodes:
-                    node = nodes[nd_ref]
-                    coordinates.append([flt(node["lon"]), flt(node["lat"])])
-
-            is_closed = (
-                (main_element["nodes"][0] == main_element["nodes"][-1])
-                if main_element.get("nodes")
-                else False
-            )
-
-            if is_closed and len(coordinates) >= 4:
-                geometry = {"type": "Polygon", "coordinates": [coordinates]}
+            refs = ways.get(main_element["id"], array("q"))
+            outline = resolve(refs)
+
+            is_closed = len(refs) > 1 and refs[0] == refs[-1]
+            if is_closed and len(outline) >= 4:
+                geometry = Polygon(outline)
+            elif len(outline) >= 2:
+                geometry = LineString(outline)
             else:
-                geometry = {"type": "LineString", "coordinates": coordinates}
-
-            # Calculate bounds
-            if coordinates:
-                all_lats = [coord[1] for coord in coordinates]
-                all_lons = [coord[0] for coord in coordinates]
-                result.update(
-                    {
-                        "min_lat": flt(min(all_lats)),
-                        "max_lat": flt(max(all_lats)),
-                        "min_lng": flt(min(all_lons)),
-                        "max_lng": flt(max(all_lons)),
-                        "lng": flt(sum(all_lons) / len(all_lons)),
-                        "lat": flt(sum(all_lats) / len(all_lats)),
-                    }
-                )
+                geometry = None
 
         else:  # relation
-            # Process relation members into a MultiPolygon
-            nodes = {n["id"]: n for n in osm_data["elements"] if n["type"] == "node"}
-            ways = {w["id"]: w for w in osm_data["elements"] if w["type"] == "way"}
-
             frappe.log(f"Processing relation {osm_id}")
-            frappe.log(f"Number of nodes: {len(nodes)}")
+            frappe.log(f"Number of nodes: {len(ids)}")
             frappe.log(f"Number of ways: {len(ways)}")
 
-            outer_rings = []
-            inner_rings = []
-
-            # Process outer ways (role = outer)
+            member_ways = {"outer": [], "inner": []}
             for member in main_element.get("members", []):
                 if member["type"] == "way" and member["ref"] in ways:
-                    way = ways[member["ref"]]
-                    coords = []
-
-                    for node_id in way.get("nodes", []):
-                        if node_id in nodes:
-                            node = nodes[node_id]
-                            coords.append([flt(node["lon"]), flt(node["lat"])])
-
-                    # Ensure it's a closed loop
-                    if (
-                        coords
-                        and coords[0] != coords[-1]
-                        and way["nodes"][0] == way["nodes"][-1]
-                    ):
-                        coords.append(coords[0])
-
-                    if len(coords) >= 4:
-                        if member.get("role") == "inner":
-                            inner_rings.append(coords)
-                        else:  # Default to outer
-                            outer_rings.append(coords)
-
-            # If we have outer rings, create a MultiPolygon
-            if outer_rings:
-                # For each outer ring, combine with its inner rings
-                polygons = []
-                for outer in outer_rings:
-                    # Find inner rings that are inside this outer ring
-                    # (Simplified - we should really check containment)
-                    polygon = [outer]
-                    for inner in inner_rings:
-                        polygon.append(inner)
-                    polygons.append(polygon)
-
-                geometry = {"type": "MultiPolygon", "coordinates": polygons}
-
-                # Calculate bounds from all coordinates
-                all_coords = [coord for ring in outer_rings for coord in ring]
-                if all_coords:
-                    all_lats = [coord[1] for coord in all_coords]
-                    all_lons = [coord[0] for coord in all_coords]
-                    result.update(
-                        {
-                            "min_lat": flt(min(all_lats)),
-                            "max_lat": flt(max(all_lats)),
-                            "min_lng": flt(min(all_lons)),
-                            "max_lng": flt(max(all_lons)),
-                            "lng": flt(sum(all_lons) / len(all_coords)),
-                            "lat": flt(sum(all_lats) / len(all_coords)),
-                        }
-                    )
+                    role = "inner" if member.get("role") == "inner" else "outer"
+                    member_ways[role].append(ways[member["ref"]])
 
-                    frappe.log(f"Created MultiPolygon with {len(outer_rings)} rings")
-                    frappe.log(
-                        f"Bounding box: lat [{result['min_lat']}, {result['max_lat']}], lng [{result['min_lng']}, {result['max_lng']}]"
-                    )
-            else:
+            outer_rings = [resolve(ring) for ring in stitch_rings(member_ways["outer"])]
+            inner_rings = [resolve(ring) for ring in stitch_rings(member_ways["inner"])]
+            outer_rings = [ring for ring in outer_rings if len(ring) >= 4]
+            inner_rings = [ring for ring in inner_rings if len(ring) >= 4]
+
+            if not outer_rings:
                 frappe.log_error(
                     f"No valid outer rings found for relation {osm_id}",
                     "OSM Processing",
                 )
                 return None
 
-        result["geo"] = json.dumps(geometry)
+            geometry = assemble_multipolygon(outer_rings, inner_rings)
+            outline = np.concatenate(outer_rings)
+
+            frappe.log(f"Created MultiPolygon with {len(outer_rings)} rings")
+
+        if geometry is None or not len(outline):
+            frappe.log_error(f"No geometry found for OSM ID: {osm_id}", "OSM Processing")
+            return None
+
+        min_lng, min_lat = outline.min(axis=0)
+        max_lng, max_lat = outline.max(axis=0)
+        lng, lat = outline.mean(axis=0)
+        result.update(
+            {
+                "min_lat": float(min_lat),
+                "max_lat": float(max_lat),
+                "min_lng": float(min_lng),
+                "max_lng": float(max_lng),
+                "lng": float(lng),
+                "lat": float(lat),
+            }
+        )
+        frappe.log(
+            f"Bounding box: lat [{result['min_lat']}, {result['max_lat']}], lng [{result['min_lng']}, {result['max_lng']}]"
+        )
+
+        result["geo"] = json.dumps(mapping(geometry))
         return result
 
     except Exception as e:
@@ -303,12 +499,68 @@ def process_osm_data(osm_data, osm_type, osm_id):
         return None
 
 
+def stitch_rings(ways):
+    """Join way node sequences end to end into closed rings of node IDs
+
+    Relation boundaries are usually split over many ways that share end nodes and
+    may run in either direction. Chains that never close are dropped.
+    """
+    rings = []
+    open_ways = {}
+    ends = defaultdict(set)  # end node -> indexes of open ways ending there
+
+    for i, way in enumerate(ways):
+        if len(way) < 2:
+            continue
+        if way[0] == way[-1]:
+            rings.append(way)
+            continue
+        open_ways[i] = way
+        ends[way[0]].add(i)
+        ends[way[-1]].add(i)
+
+    while open_ways:
+        i, ring = open_ways.popitem()
+        ends[ring[0]].discard(i)
+        ends[ring[-1]].discard(i)
+        ring = array("q", ring)
+
+        while ring[0] != ring[-1] and ends[ring[-1]]:
+            j = ends[ring[-1]].pop()
+            way = open_ways.pop(j)
+            ends[way[0]].discard(j)
+            ends[way[-1]].discard(j)
+
+            if way[0] == ring[-1]:
+                ring.extend(way[1:])
+            else:
+                ring.extend(reversed(way[:-1]))
+
+        if ring[0] == ring[-1]:
+            rings.append(ring)
+
+    return rings
+
+
+def assemble_multipolygon(outer_rings, inner_rings):
+    """Build a MultiPolygon, attaching each inner ring to the outer ring that contains it"""
+    outers = [Polygon(ring) for ring in outer_rings]
+    prepared_outers = [prep(outer) for outer in outers]
+    holes = [[] for _ in outers]
+
+    for ring in inner_rings:
+        point = Point(ring[0])
+        for i, outer in enumerate(prepared_outers):
+            if outer.contains(point):
+                holes[i].append(ring)
+                break
+
+    return MultiPolygon([Polygon(outer.exterior.coords, holes[i]) for i, outer in enumerate(outers)])
+
+
 def find_osm_id_for_place(name, place_type=None):
     """Try to find the OSM ID for a place by name and type"""
     try:
-        # Ensure we're not hitting rate limits
-        time.sleep(1)
-
         # Create search query
         search_url = (
             f"https://nominatim.openstreetmap.org/search?q={name}&format=json&limit=5"
@@ -321,12 +573,8 @@ def find_osm_id_for_place(name, place_type=None):
             elif place_type in ["City", "State", "District"]:
                 search_url += f"&featureType={place_type.lower()}"
 
-        response = requests.get(search_url, headers={"User-Agent": "RealEstateCRM/1.0"})
-
-        if response.status_code != 200:
-            return None
-
-        results = response.json()
+        # Only real requests count against the rate limit; cached responses come back immediately
+        results = osm_cache.get_json("GET", search_url, ttl=osm_cache.NOMINATIM_TTL, rate_limit_key="nominatim")
         if not results:
             return None
 
@@ -356,21 +604,13 @@ def find_osm_id_for_place(name, place_type=None):
 def get_location_hierarchy(lat, lng):
     """Get location hierarchy from coordinates using Nominatim"""
     try:
-        # Ensure we're not hitting rate limits
-        time.sleep(1)
-
         nominatim_url = f"https://nominatim.openstreetmap.org/reverse?lat={lat}&lon={lng}&format=json&addressdetails=1&zoom=18"
-        response = requests.get(
-            nominatim_url, headers={"User-Agent": "RealEstateCRM/1.0"}
-        )
+        result = osm_cache.get_json("GET", nominatim_url, ttl=osm_cache.NOMINATIM_TTL, rate_limit_key="nominatim")
 
-        if response.status_code != 200:
-            frappe.log_error(
-                f"Nominatim API error: {response.status_code}", "Reverse Geocoding"
-            )
+        if result is None:
+            frappe.log_error(f"Nominatim reverse lookup failed for {lat}, {lng}", "Reverse Geocoding")
             return None
 
-        result = response.json()
         address = result.get("address", {})
         display_name = result.get("display_name", "")
 
@@ -411,13 +651,33 @@ def get_location_hierarchy(lat, lng):
 # Territory hierarchy processing
 
 
+# Number of places looked up on OSM at the same time; the shared rate limiter
+# still spaces out the actual requests
+OSM_FETCH_WORKERS = 4
+
+
 def process_territory_hierarchy(hierarchy):
     """Process territory hierarchy data, creating territories as needed"""
     if not hierarchy:
         return []
 
+    # Resolve every level that already exists in a single query. Names are keyed
+    # casefolded, as the IN lookup matches them case-insensitively
+    existing = {}
+    for territory in frappe.get_all(
+        "PRP Territory",
+        filters={"territory_name": ["in", list({level["name"] for level in hierarchy})]},
+        fields=["name", "territory_name", "parent_territory", "osm_id"],
+    ):
+        existing.setdefault(territory.territory_name.casefold(), territory)
+
+    # Look up and fetch only the missing levels, concurrently
+    missing = {level["name"]: level for level in hierarchy if level["name"].casefold() not in existing}
+    osm_places = fetch_osm_places(list(missing.values()))
+
     result_hierarchy = []
     current_parent = None
+    parent_updates = {}
 
     # Process from largest area (country) to smallest (neighborhood)
     for level in hierarchy:
@@ -426,39 +686,25 @@ def process_territory_hierarchy(hierarchy):
 
         frappe.log(f"Processing hierarchy level: {place_type} - {name}")
 
-        # Check if this territory already exists
-        existing = frappe.get_all(
-            "PRP Territory",
-            filters=[
-                ["territory_name", "=", name],
-                # Optional: Add more precise filters if needed
-            ],
-            fields=["name", "parent_territory", "osm_id"],
-        )
-
-        if existing:
+        if name.casefold() in existing:
             # Use existing territory
-            territory_id = existing[0].name
-            territory_osm_id = existing[0].osm_id
+            territory = existing[name.casefold()]
+            territory_id = territory.name
+            territory_osm_id = territory.osm_id
 
             frappe.log(f"Found existing territory: {territory_id}")
 
             # If territory has no parent but should have one, update it
-            if current_parent and not existing[0].parent_territory:
-                frappe.db.set_value(
-                    "PRP Territory", territory_id, "parent_territory", current_parent
-                )
-                frappe.log(f"Updated parent of {territory_id} to {current_parent}")
+            if current_parent and not territory.parent_territory and current_parent != territory_id:
+                parent_updates[territory_id] = current_parent
+                territory.parent_territory = current_parent
+                frappe.log(f"Updating parent of {territory_id} to {current_parent}")
         else:
-            # Try to find OSM ID for this place
-            osm_id = find_osm_id_for_place(name, place_type)
+            osm_id, osm_data = osm_places.get(name, (None, None))
 
             if osm_id:
                 frappe.log(f"Found OSM ID for {name}: {osm_id}")
 
-                # Fetch OSM data including boundaries
-                osm_data = fetch_osm_data(osm_id)
-
                 if osm_data:
                     # Create new territory with OSM data
                     new_territory = frappe.new_doc("PRP Territory")
@@ -516,6 +762,12 @@ def process_territory_hierarchy(hierarchy):
                     name, place_type, current_parent
                 )
 
+            # Later levels with the same name reuse what we just created
+            if territory_id:
+                existing[name.casefold()] = frappe._dict(
+                    name=territory_id, parent_territory=current_parent, osm_id=territory_osm_id
+                )
+
         # Add to result hierarchy
         result_hierarchy.append(
             {
@@ -529,9 +781,68 @@ def process_territory_hierarchy(hierarchy):
         # Update current parent for next level
         current_parent = territory_id
 
+    if parent_updates:
+        set_parent_territories(parent_updates)
+
     return result_hierarchy
 
 
+def fetch_osm_places(levels):
+    """Find and fetch OSM data for several places at once
+
+    Returns {place name: (osm_id, osm_data)}. Each lookup runs in its own thread
+    with its own site context; requests are spaced out by the shared rate limiter.
+    """
+    if not levels:
+        return {}
+
+    site = frappe.local.site
+    sites_path = frappe.local.sites_path
+
+    def fetch_place(level):
+        osm_id, osm_data = None, None
+        try:
+            frappe.init(site=site, sites_path=sites_path)
+            frappe.connect()
+            osm_id = find_osm_id_for_place(level["name"], level["type"])
+            osm_data = fetch_osm_data(osm_id) if osm_id else None
+            # Keep any error logs written while fetching
+            frappe.db.commit()
+        except Exception:
+            # The level falls back to a placeholder territory
+            pass
+        finally:
+            frappe.destroy()
+
+        return level["name"], (osm_id, osm_data)
+
+    with ThreadPoolExecutor(max_workers=min(OSM_FETCH_WORKERS, len(levels))) as executor:
+        return dict(executor.map(fetch_place, levels))
+
+
+def set_parent_territories(parents):
+    """Set parent_territory for many territories in a single UPDATE
+
+    parents: {territory name: parent territory name}
+    """
+    if not parents:
+        return
+
+    cases = " ".join(["WHEN %s THEN %s"] * len(parents))
+    values = [value for pair in parents.items() for value in pair]
+
+    frappe.db.sql(
+        f"""
+        UPDATE `tabPRP Territory`
+        SET parent_territory = CASE name {cases} END, modified = %s, modified_by = %s
+        WHERE name IN %s
+        """,
+        (*values, now(), frappe.session.user, tuple(parents)),
+    )
+    set_territory_parents(parents)
+    clear_territory_ancestry_cache()
+
+
 def create_placeholder_territory(name, territory_type, parent=None, osm_id=None):
     """Create a placeholder territory when OSM data isn't available"""
     try:
@@ -627,21 +938,14 @@ def create_territory_from_geometry():
         # Insert the territory
         territory.insert(ignore_permissions=True)
 
-        # After inserting, check for territories that should be phases of this project
-        territory.detect_potential_subprojects()
-
-        # Get potential phases if they exist
-        potential_phases = []
-        cached_phases = frappe.cache().get_value(f"potential_phases_{territory.name}")
-        if cached_phases:
-            potential_phases = json.loads(cached_phases)
-
-        # Return success response with hierarchy info and potential phases
+        # Potential phases are detected by the background hierarchy update and
+        # arrive with the prp:territory_hierarchy event or get_territory_hierarchy_status
         return {
             "success": True,
             "territory_id": territory.name,
             "hierarchy": [h["name"] for h in processed_hierarchy],
-            "potential_phases": potential_phases
+            "potential_phases": [],
+            "hierarchy_status": "Queued",
         }
 
     except Exception as e:
@@ -677,8 +981,8 @@ def create_phase_for_project(project_id, phase_data):
             return {"success": False, "message": "Failed to process geometry"}
 
         # Verify phase is within project boundaries
-        is_within = verify_geometry_within(geometry, json.loads(parent_project.geo))
-        if not is_within:
+        project_geo = geometry_cache.get_prepared(project_id, parent_project.modified, parent_project.geo)
+        if not project_geo.contains(shape(geometry)):
             return {
                 "success": False,
                 "message": "Phase boundaries must be within project boundaries",
@@ -747,6 +1051,9 @@ def convert_to_phases(project_id, phase_ids=None):
             )
             converted.append(territory.territory_name)
 
+        set_territory_parents({phase_id: project_id for phase_id in phase_ids})
+        clear_territory_ancestry_cache()
+
         return {
             "success": True,
             "message": f"Converted {len(converted)} territories to phases",
@@ -769,10 +1076,187 @@ def clear_potential_phases(project_id):
         return {"success": False, "message": str(e)}
 
 
+@frappe.whitelist()
+def resolve_territories_for_points(points):
+    """Resolve the smallest containing territory, and its chain of parents, for each coordinate
+
+    points: list of {"lat": ..., "lng": ..., "id": ...} dicts or [lat, lng] pairs. The
+    optional id (e.g. a PRP Building name) is echoed back. Results follow the input
+    order; each chain runs from the largest territory down to the smallest.
+    """
+    try:
+        if isinstance(points, str):
+            points = json.loads(points)
+
+        if not points:
+            return {"success": True, "results": []}
+
+        ids = [p.get("id") if isinstance(p, dict) else None for p in points]
+        lats = np.array([flt(p["lat"] if isinstance(p, dict) else p[0]) for p in points], dtype=float)
+        lngs = np.array([flt(p["lng"] if isinstance(p, dict) else p[1]) for p in points], dtype=float)
+
+        # Group point indexes by every cell on their path from the root
+        spatial_index = get_spatial_index()
+        points_by_cell = defaultdict(list)
+        for i in range(len(points)):
+            cell_id = spatial_index.generate_cell_id(lats[i], lngs[i], MAX_QUADTREE_LEVEL)
+            for level in range(len(cell_id) + 1):
+                points_by_cell[cell_id[:level]].append(i)
+
+        # A territory can only contain a point if one of its covering cells is on that path
+        cells_by_territory = defaultdict(list)
+        lookup_cells = list(points_by_cell)
+        for start in range(0, len(lookup_cells), 1000):
+            rows = frappe.db.sql(
+                """
+                SELECT parent, cell_id
+                FROM `tabPRP Territory Cell`
+                WHERE parenttype = 'PRP Territory'
+                  AND is_ancestor = 0
+                  AND cell_id IN %(cells)s
+                """,
+                {"cells": tuple(lookup_cells[start : start + 1000])},
+            )
+            for parent, cell_id in rows:
+                cells_by_territory[parent].append(cell_id)
+
+        territories = []
+        if cells_by_territory:
+            territories = frappe.get_all(
+                "PRP Territory",
+                filters={"name": ["in", list(cells_by_territory)]},
+                fields=["name", "modified"],
+            )
+        geometries = geometry_cache.get_many(territories)
+
+        # Keep the smallest containing territory for every point
+        smallest = [None] * len(points)
+        smallest_area = np.full(len(points), np.inf)
+        for name, cells in cells_by_territory.items():
+            geometry = geometries.get(name)
+            if geometry is None:
+                continue
+
+            candidates = np.unique(np.concatenate([points_by_cell[cell] for cell in cells]))
+            shapely.prepare(geometry)
+            inside = candidates[shapely.contains_xy(geometry, lngs[candidates], lats[candidates])]
+
+            area = geometry.area
+            for i in inside[smallest_area[inside] > area]:
+                smallest[i] = name
+                smallest_area[i] = area
+
+        chains = get_territory_chains({name for name in smallest if name})
+
+        return {
+            "success": True,
+            "results": [
+                {
+                    "id": ids[i],
+                    "lat": float(lats[i]),
+                    "lng": float(lngs[i]),
+                    "territory": smallest[i],
+                    "chain": chains.get(smallest[i], []),
+                }
+                for i in range(len(points))
+            ],
+        }
+
+    except Exception as e:
+        frappe.log_error(f"Error resolving territories for points: {str(e)}", "Territory Resolution")
+        return {"success": False, "message": str(e)}
+
+
+def get_territory_chains(names):
+    """Get the chain of territories from the root down to each of the given territories"""
+    if not names:
+        return {}
+
+    rows = frappe.db.sql(
+        """
+        SELECT c.descendant, t.name, t.territory_name, t.name_en, t.is_project, t.is_phase
+        FROM `tabPRP Territory Closure` c
+        INNER JOIN `tabPRP Territory` t ON t.name = c.ancestor
+        WHERE c.descendant IN %s
+        ORDER BY c.depth DESC
+        """,
+        (tuple(names),),
+        as_dict=True,
+    )
+
+    chains = {name: [] for name in names}
+    for row in rows:
+        chains[row.pop("descendant")].append(row)
+
+    return chains
+
+
+# Territory ancestry cache
+
+TERRITORY_ANCESTRY_KEY = "prp:territory_ancestry"
+TERRITORY_ANCESTRY_FIELDS = ["name", "parent_territory", "name_en", "is_project", "is_phase"]
+
+
+def get_territory_ancestry(name):
+    """Get a territory followed by its ancestors up to the root, without loading geo
+
+    Served from a Redis hash that is cleared whenever the hierarchy or the names
+    of territories change.
+    """
+    if not name:
+        return []
+
+    def load_ancestry():
+        ancestry = get_ancestors(name, TERRITORY_ANCESTRY_FIELDS)
+        if not ancestry and frappe.db.exists("PRP Territory", name):
+            frappe.log_error(
+                f"Territory {name} has no closure rows, run rebuild_territory_closure", "PRP Territory Closure"
+            )
+            ancestry = walk_territory_ancestry(name)
+        return ancestry
+
+    return [frappe._dict(row) for row in frappe.cache().hget(TERRITORY_ANCESTRY_KEY, name, load_ancestry)]
+
+
+def walk_territory_ancestry(name):
+    """Get the ancestry by following parent_territory, for territories missing from the closure table"""
+    ancestry = []
+    seen = set()
+    while name and name not in seen:
+        seen.add(name)
+        territory = frappe.db.get_value("PRP Territory", name, TERRITORY_ANCESTRY_FIELDS, as_dict=True)
+        if not territory:
+            break
+        ancestry.append(territory)
+        name = territory.parent_territory
+    return ancestry
+
+
+def clear_territory_ancestry_cache():
+    # Cleared again when the transaction ends, as readers in between may cache the old tree
+    delete_territory_ancestry_cache()
+    prp.run_after_commit(delete_territory_ancestry_cache)
+    frappe.db.after_rollback.add(delete_territory_ancestry_cache)
+
+
+def delete_territory_ancestry_cache():
+    frappe.cache().delete_key(TERRITORY_ANCESTRY_KEY)
+
+
 
 # QuadTree spatial indexing
+
+# Fixed root extent for the quadtree. Cell IDs are derived from it, so it must
+# never depend on the territories that happen to be loaded.
+CANONICAL_BOUNDS = [-180.0, -90.0, 180.0, 90.0]  # [min_lng, min_lat, max_lng, max_lat]
+MAX_QUADTREE_LEVEL = 18
+
+# Upper bound on the number of cells used to cover a single territory
+MAX_COVERING_CELLS = 8
+
+
 class QuadTreeNode:
-    def __init__(self, bounds, level=0, max_level=6):
+    def __init__(self, bounds, level=0, max_level=MAX_QUADTREE_LEVEL):
         self.bounds = bounds  # [min_lng, min_lat, max_lng, max_lat]
         self.level = level
         self.max_level = max_level
@@ -811,31 +1295,10 @@ class QuadTreeNode:
 
 
 class SpatialIndex:
-    def __init__(self):
-        # Get the bounds from existing territories or use default Middle East bounds
-        territories = frappe.get_all(
-            "PRP Territory", fields=["min_lat", "max_lat", "min_lng", "max_lng"]
-        )
-
-        if territories:
-            min_lng = min(flt(t.min_lng) for t in territories)
-            min_lat = min(flt(t.min_lat) for t in territories)
-            max_lng = max(flt(t.max_lng) for t in territories)
-            max_lat = max(flt(t.max_lat) for t in territories)
-
-            # Add buffer
-            buffer = 5.0  # 5 degrees buffer
-            min_lng -= buffer
-            min_lat -= buffer
-            max_lng += buffer
-            max_lat += buffer
-        else:
-            # Default to Middle East bounds if no territories exist
-            min_lng, min_lat = 35.0, 12.0
-            max_lng, max_lat = 60.0, 32.0
-
-        self.root = QuadTreeNode([min_lng, min_lat, max_lng, max_lat])
-        self.territory_cells = {}
+    def __init__(self, bounds=None):
+        # The root extent is fixed so that cell IDs stored on territories stay valid
+        # across restarts, no matter which territories exist when a worker boots
+        self.root = QuadTreeNode(list(bounds or CANONICAL_BOUNDS), max_level=MAX_QUADTREE_LEVEL)
 
     def generate_cell_id(self, lat, lng, level):
        """Generate a hierarchical cell ID based on location"""
@@ -875,36 +1338,271 @@ class SpatialIndex:
             mid_lng = (bounds[0] + bounds[2]) / 2
             mid_lat = (bounds[1] + bounds[3]) / 2
 
+            # Same encoding as generate_cell_id: +1 for north, +2 for east
             quadrant = int(digit)
-            if quadrant in (0, 2):  # West
-                bounds[2] = mid_lng
-            else:  # East
+            if quadrant & 2:  # East
                 bounds[0] = mid_lng
-            if quadrant in (0, 1):  # South
-                bounds[3] = mid_lat
-            else:  # North
+            else:  # West
+                bounds[2] = mid_lng
+            if quadrant & 1:  # North
                 bounds[1] = mid_lat
+            else:  # South
+                bounds[3] = mid_lat
 
         return bounds
 
-    def get_covering_cells(self, bounds, max_level=6):
-        """Get all cells that cover a territory's bounds"""
-        min_cell = self.generate_cell_id(bounds[1], bounds[0], max_level)
-        max_cell = self.generate_cell_id(bounds[3], bounds[2], max_level)
-
-        # Find common prefix
-        common_prefix = ""
-        for i in range(min(len(min_cell), len(max_cell))):
-            if min_cell[i] == max_cell[i]:
-                common_prefix += min_cell[i]
-            else:
+    def get_level_for_bounds(self, bounds):
+        """Get the deepest quadtree level whose cells are still larger than the bounds"""
+        lng_span = flt(bounds[2]) - flt(bounds[0])
+        lat_span = flt(bounds[3]) - flt(bounds[1])
+        root_lng_span = self.root.bounds[2] - self.root.bounds[0]
+        root_lat_span = self.root.bounds[3] - self.root.bounds[1]
+
+        level = 0
+        while (
+            level < self.root.max_level
+            and lng_span <= root_lng_span / 2 ** (level + 1)
+            and lat_span <= root_lat_span / 2 ** (level + 1)
+        ):
+            level += 1
+
+        return level
+
+    def get_cell_id(self, column, row, level):
+        """Build the cell ID of a grid column and row at the given level"""
+        cell_id = ""
+        for shift in range(level - 1, -1, -1):
+            cell_id += str(((row >> shift) & 1) + 2 * ((column >> shift) & 1))
+        return cell_id
+
+    def get_cells_for_bounds(self, bounds, level):
+        """Get every cell at the given level that the bounds touch"""
+        size = 2**level
+        root = self.root.bounds
+        cell_width = (root[2] - root[0]) / size
+        cell_height = (root[3] - root[1]) / size
+
+        # Values on a cell edge belong to the lower cell, as in generate_cell_id
+        def grid_index(value, origin, step):
+            return min(max(math.ceil((flt(value) - origin) / step) - 1, 0), size - 1)
+
+        columns = range(grid_index(bounds[0], root[0], cell_width), grid_index(bounds[2], root[0], cell_width) + 1)
+        rows = range(grid_index(bounds[1], root[1], cell_height), grid_index(bounds[3], root[1], cell_height) + 1)
+
+        return [self.get_cell_id(column, row, level) for column in columns for row in rows]
+
+    def get_covering_cells(self, bounds, geometry=None, max_cells=MAX_COVERING_CELLS):
+        """Get a bounded set of cells that together cover a territory
+
+        Starts at the level where the bounds span at most 2x2 cells and keeps
+        subdividing while the cells touching the geometry still fit in max_cells.
+        """
+        prepared = prep(geometry) if geometry is not None else None
+
+        def touches(cell_id):
+            cell_bounds = self.get_cell_bounds(cell_id)
+            if (
+                cell_bounds[0] > bounds[2]
+                or cell_bounds[2] < bounds[0]
+                or cell_bounds[1] > bounds[3]
+                or cell_bounds[3] < bounds[1]
+            ):
+                return False
+            return prepared is None or prepared.intersects(box(*cell_bounds))
+
+        level = self.get_level_for_bounds(bounds)
+        cells = [cell for cell in self.get_cells_for_bounds(bounds, level) if touches(cell)]
+
+        while level < self.root.max_level:
+            children = [cell + digit for cell in cells for digit in "0123" if touches(cell + digit)]
+            if not children or len(children) > max_cells:
                 break
+            cells = children
+            level += 1
+
+        return cells
+
+
+def get_ancestor_cells(cells):
+    """Get the strict ancestors of the given cells, excluding the cells themselves"""
+    return {cell[:i] for cell in cells for i in range(len(cell))} - set(cells)
+
+
+def get_territories_in_cells(cells, exclude=None):
+    """Get the names of territories whose covering intersects any of the given cells
+
+    Two cells intersect only when they are equal or one is an ancestor of the
+    other, so both directions are plain equality lookups on the cell index.
+    """
+    if not cells:
+        return []
+
+    cells = tuple(cells)
+    lookup_cells = cells + tuple(get_ancestor_cells(cells))
+
+    territories = frappe.db.sql(
+        """
+        SELECT DISTINCT parent
+        FROM `tabPRP Territory Cell`
+        WHERE parenttype = 'PRP Territory'
+          AND parent != %(exclude)s
+          AND (
+            (is_ancestor = 0 AND cell_id IN %(lookup_cells)s)
+            OR (is_ancestor = 1 AND cell_id IN %(cells)s)
+          )
+        """,
+        {"exclude": exclude or "", "lookup_cells": lookup_cells, "cells": cells},
+    )
+
+    return [t[0] for t in territories]
+
+
+_spatial_index = None
+
 
-        # Use common prefix as the cell ID
-        return [common_prefix] if common_prefix else [min_cell]
+def get_spatial_index():
+    """Return the process-wide spatial index, building it on first use"""
+    global _spatial_index
+
+    if _spatial_index is None:
+        _spatial_index = SpatialIndex()
+
+    return _spatial_index
+
+
+@frappe.whitelist()
+def rebuild_spatial_index():
+    """Recompute the covering cells of every territory against the canonical root extent"""
+    frappe.only_for("System Manager")
+
+    territories = frappe.get_all("PRP Territory", pluck="name")
+
+    for name in territories:
+        rebuild_territory_spatial_index(name)
+
+    frappe.db.commit()
+
+    return {"success": True, "message": f"Rebuilt spatial index for {len(territories)} territories"}
+
+
+def rebuild_territory_spatial_index(name):
+    """Recompute and store the covering cells of a single territory without saving it"""
+    territory = frappe.get_doc("PRP Territory", name)
+    territory.update_spatial_index()
+    territory.db_update()
+    territory.update_child_table("spatial_cells")
+
+
+# Background hierarchy updates
+
+# Territories are grouped into regions by their cell at this level, so that one
+# job recomputes the hierarchy for every territory inserted in a region
+HIERARCHY_REGION_LEVEL = 6
+HIERARCHY_PENDING_KEY = "prp:territory_hierarchy_pending"
+HIERARCHY_QUEUED_KEY = "prp:territory_hierarchy_queued"
+HIERARCHY_STATUS_KEY = "prp:territory_hierarchy_status"
+
+# Pending entries whose territory never got committed are dropped after this long
+HIERARCHY_PENDING_TIMEOUT = 3600
+
+
+def get_hierarchy_region(territory):
+    """Get the coarse cell that groups hierarchy updates for a territory"""
+    return (territory.spatial_index_cell or "")[:HIERARCHY_REGION_LEVEL]
+
+
+def enqueue_hierarchy_update(territory):
+    """Queue a hierarchy update for a territory, coalesced with others in its region"""
+    region = get_hierarchy_region(territory)
+    cache = frappe.cache()
+
+    cache.hset(f"{HIERARCHY_PENDING_KEY}:{region}", territory.name, now())
+    set_hierarchy_status(territory.name, "Queued")
+
+    # Only queue the job once the territory is committed, a rolled back save must
+    # not leave the region flagged as queued
+    if frappe.flags.in_test:
+        queue_hierarchy_job(region)
+    else:
+        frappe.db.after_commit.add(partial(queue_hierarchy_job, region))
+
+
+def queue_hierarchy_job(region):
+    cache = frappe.cache()
+
+    # A queued job for the region picks up everything pending when it starts
+    if cache.get_value(f"{HIERARCHY_QUEUED_KEY}:{region}"):
+        return
+
+    cache.set_value(f"{HIERARCHY_QUEUED_KEY}:{region}", 1, expires_in_sec=600)
+    frappe.enqueue(
+        "prp.prp.doctype.prp_territory.prp_territory.process_pending_hierarchy_updates",
+        queue="long",
+        now=frappe.flags.in_test,
+        region=region,
+    )
+
+
+def process_pending_hierarchy_updates(region):
+    """Recompute the hierarchy of every territory pending in a region"""
+    cache = frappe.cache()
+    pending_key = f"{HIERARCHY_PENDING_KEY}:{region}"
+
+    # Clear the flag first so inserts from here on queue another job
+    cache.delete_value(f"{HIERARCHY_QUEUED_KEY}:{region}")
+    pending = {frappe.safe_decode(key): value for key, value in cache.hgetall(pending_key).items()}
+
+    # Oldest first, so that parents created in the same batch are placed first
+    for name in sorted(pending, key=pending.get):
+        if not frappe.db.exists("PRP Territory", name):
+            # Not committed yet (its own job will follow) or rolled back
+            if time_diff_in_seconds(now_datetime(), pending[name]) > HIERARCHY_PENDING_TIMEOUT:
+                cache.hdel(pending_key, name)
+            continue
+
+        cache.hdel(pending_key, name)
+        set_hierarchy_status(name, "Running")
+
+        try:
+            territory = frappe.get_doc("PRP Territory", name)
+            territory.run_hierarchy_update()
+            frappe.db.commit()
+            set_hierarchy_status(name, "Completed")
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(f"Error updating hierarchy for {name}: {str(e)}", "Territory Hierarchy")
+            set_hierarchy_status(name, "Failed")
+            continue
+
+        frappe.publish_realtime(
+            "prp:territory_hierarchy",
+            get_territory_hierarchy_status(name),
+            user=territory.owner,
+        )
+        prp.refetch_resource(territory, "doc_update")
+
+
+def set_hierarchy_status(name, status):
+    frappe.cache().set_value(f"{HIERARCHY_STATUS_KEY}:{name}", status, expires_in_sec=86400)
+
+
+@frappe.whitelist()
+def get_territory_hierarchy_status(territory):
+    """Get the state of the background hierarchy update for a territory"""
+    potential_phases = frappe.cache().get_value(f"potential_phases_{territory}")
+
+    return {
+        "territory": territory,
+        "status": frappe.cache().get_value(f"{HIERARCHY_STATUS_KEY}:{territory}") or "Completed",
+        "parent_territory": frappe.db.get_value("PRP Territory", territory, "parent_territory"),
+        "potential_phases": json.loads(potential_phases) if potential_phases else [],
+    }
+
+
+def on_doctype_update():
+    # Keyset pagination, see prp.pagination
+    frappe.db.add_index("PRP Territory", ["creation", "name"])
 
-# Create global spatial index
-spatial_index = SpatialIndex()
 
 # Territory document class
 class PRPTerritory(Document):
@@ -926,62 +1624,61 @@ class PRPTerritory(Document):
     def update_spatial_index(self):
         """Update spatial index information for the territory"""
         try:
-            # Get bounds
-            bounds = [
-               flt(self.min_lng),
-               flt(self.min_lat),
-               flt(self.max_lng),
-               flt(self.max_lat)
-           ]
+            spatial_index = get_spatial_index()
+
+            geometry = shape(json.loads(self.geo)) if self.geo else None
+            if geometry is not None and not geometry.is_empty:
+                bounds = list(geometry.bounds)
+            else:
+                geometry = None
+                bounds = [flt(self.min_lng), flt(self.min_lat), flt(self.max_lng), flt(self.max_lat)]
 
-            # Calculate appropriate quadtree level based on territory size
-            lng_span = bounds[2] - bounds[0]
-            lat_span = bounds[3] - bounds[1]
-            max_span = max(lng_span, lat_span)
+            cells = spatial_index.get_covering_cells(bounds, geometry)
 
-            # Adjust level based on territory size
-            quadtree_level = 6  # default
-            if max_span > 1.0:
-                quadtree_level = 2
-            elif max_span > 0.1:
-                quadtree_level = 4
+            # Smallest single cell holding the whole covering
+            enclosing_cell = os.path.commonprefix(cells) if cells else ""
 
-            # Get covering cells
-            cells = spatial_index.get_covering_cells(bounds, quadtree_level)
-            cell_bounds = spatial_index.get_cell_bounds(cells[0])
+            self.spatial_index_cell = enclosing_cell
+            self.quadtree_level = len(enclosing_cell)
+            self.cell_bounds = json.dumps(spatial_index.get_cell_bounds(enclosing_cell))
 
-            # Update document fields
-            frappe.db.set_value(
-               "PRP Territory", 
-               self.name, 
-               {
-                   "quadtree_level": quadtree_level,
-                   "spatial_index_cell": cells[0],
-                   "cell_bounds": json.dumps(cell_bounds)
-               }
-           )
+            self.set("spatial_cells", [])
+            for cell in cells:
+                self.append("spatial_cells", {"cell_id": cell, "level": len(cell), "is_ancestor": 0})
+            for cell in sorted(get_ancestor_cells(cells)):
+                self.append("spatial_cells", {"cell_id": cell, "level": len(cell), "is_ancestor": 1})
 
-            frappe.log(f"Updated spatial index for {self.name}: Level {quadtree_level}, Cell {cells[0]}")
+            frappe.log(f"Updated spatial index for {self.name}: {len(cells)} cells under {enclosing_cell}")
 
         except Exception as e:
             frappe.log_error(f"Error updating spatial index: {str(e)}", "PRP Territory Spatial Index")
 
+    def update_geometry_tiers(self):
+        """Update the simplified copies of the geometry served to lists and maps"""
+        try:
+            for field, geo in get_geometry_tiers(self.geo).items():
+                self.set(field, geo)
+        except Exception as e:
+            frappe.log_error(f"Error simplifying geometry: {str(e)}", "PRP Territory Geometry")
+
+    def get_covering_cells(self):
+        """Get the covering cells stored for this territory"""
+        return [row.cell_id for row in self.spatial_cells if not row.is_ancestor]
+
     def get_potential_overlaps(self):
         """Enhanced territory overlap detection using spatial index"""
         frappe.log(f"\n=== Checking potential overlaps ===")
 
-        # Get territories in the same or adjacent cells
-        cell_id = self.spatial_index_cell
-        parent_cell = cell_id[:-1] if cell_id else ""
+        # Territories sharing any of our covering cells, in either direction
+        candidates = get_territories_in_cells(self.get_covering_cells(), exclude=self.name)
+        if not candidates:
+            return []
 
         potential_territories = frappe.get_all(
            "PRP Territory",
-           filters={
-               "name": ["!=", self.name],
-               "spatial_index_cell": ["like", f"{parent_cell}%"]
-           },
-           fields=[
-               "name", "geo", "parent_territory", "min_lat", "max_lat",
+           filters={"name": ["in", candidates]},
+       fields=[
+               "name", "modified", "parent_territory", "min_lat", "max_lat",
                "min_lng", "max_lng", "territory_name", "spatial_index_cell",
                "is_project", "is_phase"
            ]
@@ -1014,30 +1711,25 @@ class PRPTerritory(Document):
             return
 
         try:
-            current_geo = shape(json.loads(self.geo))
+            current_geo = geometry_cache.get(self.name, self.modified, self.geo)
             frappe.log(f"Current territory geometry type: {current_geo.geom_type}")
 
             potential_territories = self.get_potential_overlaps()
             frappe.log(
                f"Found {len(potential_territories)} potential overlapping territories"
            )
+            geometries = geometry_cache.get_many(potential_territories)
 
             overlap_threshold = 80
             potential_parents = []
             potential_children = []
 
-            # Get existing territory hierarchy
-            all_territories = frappe.get_all(
-               "PRP Territory", fields=["name", "parent_territory"]
-           )
-            territory_hierarchy = {t.name: t.parent_territory for t in all_territories}
-
             for territory in potential_territories:
                 frappe.log(
                    f"\nChecking territory: {territory.name} ({territory.territory_name})"
                )
                 try:
-                    other_geo = shape(json.loads(territory.geo))
+                    other_geo = geometries[territory.name]
 
                     # Check if other territory is inside current territory
                     overlap = calculate_overlap_percentage(other_geo, current_geo)
@@ -1048,7 +1740,7 @@ class PRPTerritory(Document):
                         potential_children.append(
                            {
                                "name": territory.name,
-                               "current_parent": territory_hierarchy.get(territory.name),
+                               "current_parent": territory.parent_territory,
                                "area": other_geo.area,
                            }
                        )
@@ -1082,6 +1774,7 @@ class PRPTerritory(Document):
                 frappe.db.set_value(
                    "PRP Territory", self.name, "parent_territory", parent['name']
                )
+                set_territory_parents({self.name: parent["name"]})
 
             # Process children
             if potential_children:
@@ -1112,6 +1805,9 @@ class PRPTerritory(Document):
                         frappe.db.set_value(
                            "PRP Territory", child_name, "parent_territory", self.name
                        )
+                        set_territory_parents({child_name: self.name})
+
+            clear_territory_ancestry_cache()
 
             frappe.log("\n=== Finished hierarchy update ===")
             frappe.db.commit()
@@ -1129,29 +1825,36 @@ class PRPTerritory(Document):
                 return
 
             # Get our geometry
-            parent_geo = shape(json.loads(self.geo))
+            parent_geo = geometry_cache.get(self.name, self.modified, self.geo)
+            prepared_parent_geo = geometry_cache.get_prepared(self.name, self.modified, self.geo)
 
             # Find potential territories that might be contained
+            candidates = get_territories_in_cells(self.get_covering_cells(), exclude=self.name)
+            if not candidates:
+                return
+
             potential_subprojects = frappe.get_all(
                 "PRP Territory",
                 filters={
-                    "name": ["!=", self.name],
+                    "name": ["in", candidates],
                     "is_project": 1,
                     "is_phase": 0,  # Not already a phase
                     "parent_territory": ["!=", self.name],  # Not already our children
-                    "spatial_index_cell": ["like", f"{self.spatial_index_cell}%"],
                 },
-                fields=["name", "geo", "territory_name"],
+                fields=["name", "modified", "territory_name"],
             )
-
+            geometries = geometry_cache.get_many(potential_subprojects)
 
             contained_projects = []
 
             for territory in potential_subprojects:
                 try:
-                    # Check if fully contained
-                    territory_geo = shape(json.loads(territory.geo))
-                    containment_pct = calculate_overlap_percentage(territory_geo, parent_geo)
+                    # Check if fully contained, falling back to the overlap area
+                    territory_geo = geometries[territory.name]
+                    if prepared_parent_geo.contains(territory_geo):
+                        containment_pct = 100
+                    else:
+                        containment_pct = calculate_overlap_percentage(territory_geo, parent_geo)
 
                     # If 95%+ contained, it's a candidate phase
                     if containment_pct >= 95:
@@ -1175,8 +1878,11 @@ class PRPTerritory(Document):
             frappe.log_error(f"Error detecting subprojects: {str(e)}", "Project Hierarchy")
 
     def after_insert(self):
-        self.update_spatial_index()
+        # Hierarchy detection runs in the background; phases keep their explicit parent
+        if not self.is_phase:
+            enqueue_hierarchy_update(self)
 
+    def run_hierarchy_update(self):
         # Only run overlap detection for non-placeholder territories
         # and don't run for territories that are explicitly phases
         if not self.is_phase:
@@ -1186,6 +1892,18 @@ class PRPTerritory(Document):
         if self.is_project and not self.is_phase:
             self.detect_potential_subprojects()
 
+    def on_update(self):
+        if self.has_value_changed("parent_territory"):
+            set_territory_parents({self.name: self.parent_territory})
+
+        if any(self.has_value_changed(field) for field in TERRITORY_ANCESTRY_FIELDS):
+            clear_territory_ancestry_cache()
+
+    def on_trash(self):
+        geometry_cache.invalidate(self.name)
+        remove_territory(self.name)
+        clear_territory_ancestry_cache()
+
     def validate(self):
         if not self.territory_name:
             frappe.throw("Territory Name is required")
@@ -1194,6 +1912,17 @@ class PRPTerritory(Document):
         if not self.geo:
             frappe.throw("Geometry data is required")
 
+        # The closure table can't hold a cycle, so refuse one before it is saved
+        if self.parent_territory and self.has_value_changed("parent_territory"):
+            if self.parent_territory in get_descendants(self.name) or self.parent_territory == self.name:
+                frappe.throw(f"{self.parent_territory} lies under {self.name} and cannot be its parent")
+
+        if self.is_new() or self.has_value_changed("geo") or not self.spatial_cells:
+            self.update_spatial_index()
+
+        if self.is_new() or self.has_value_changed("geo") or not self.geo_low:
+            self.update_geometry_tiers()
+
         # Validate phase relationships
         if self.is_phase:
             # Check if parent is a project
@@ -0,0 +1,247 @@
+# Copyright (c) 2025, Yamen Zakhour and contributors
+# For license information, please see license.txt
+
+import hashlib
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import cint, now
+
+import prp
+
+# One row per (ancestor, descendant) pair of the territory hierarchy, including
+# each territory paired with itself at depth 0, so subtrees and ancestor chains
+# are single indexed lookups instead of walks along parent_territory.
+
+SUBTREE_CACHE_KEY = "prp:territory_subtree"
+SUBTREE_VERSION_KEY = "prp:territory_subtree_version"
+
+SUBTREE_FIELDS = ["name", "territory_name", "name_en", "parent_territory", "is_project", "is_phase", "is_custom"]
+
+
+class PRPTerritoryClosure(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_unique("PRP Territory Closure", ["ancestor", "descendant"], constraint_name="ancestor_descendant")
+	frappe.db.add_index("PRP Territory Closure", ["descendant", "depth"])
+
+
+def get_closure_name(ancestor, descendant):
+	return hashlib.md5(f"{ancestor}>{descendant}".encode()).hexdigest()
+
+
+def get_subtree(name):
+	return frappe.db.sql_list(
+		"SELECT descendant FROM `tabPRP Territory Closure` WHERE ancestor = %s", name
+	)
+
+
+def set_territory_parents(parents):
+	"""Move territories, with everything under them, below new parents
+
+	parents: {territory name: parent territory name or None}
+	"""
+	for name, parent in parents.items():
+		move_subtree(name, parent)
+	clear_subtree_cache()
+
+
+def move_subtree(name, parent):
+	subtree = get_subtree(name)
+	if not subtree:
+		insert_self_row(name)
+		subtree = [name]
+
+	if parent in subtree:
+		frappe.log_error(f"Not moving {name} under its own descendant {parent}", "PRP Territory Closure")
+		return
+
+	# Detach the subtree from its old ancestors
+	frappe.db.sql(
+		"""
+		DELETE FROM `tabPRP Territory Closure`
+		WHERE descendant IN %(subtree)s AND ancestor NOT IN %(subtree)s
+	""",
+		{"subtree": tuple(subtree)},
+	)
+
+	if not parent:
+		return
+
+	if not frappe.db.exists("PRP Territory Closure", {"ancestor": parent, "descendant": parent}):
+		move_subtree(parent, frappe.db.get_value("PRP Territory", parent, "parent_territory"))
+
+	# Pair every ancestor of the new parent with every member of the subtree
+	timestamp = now()
+	frappe.db.sql(
+		"""
+		INSERT INTO `tabPRP Territory Closure`
+			(name, creation, modified, owner, modified_by, ancestor, descendant, depth)
+		SELECT
+			MD5(CONCAT(a.ancestor, '>', s.descendant)), %(now)s, %(now)s, %(user)s, %(user)s,
+			a.ancestor, s.descendant, a.depth + s.depth + 1
+		FROM `tabPRP Territory Closure` a, `tabPRP Territory Closure` s
+		WHERE a.descendant = %(parent)s AND s.ancestor = %(name)s
+	""",
+		{"parent": parent, "name": name, "now": timestamp, "user": frappe.session.user},
+	)
+
+
+def insert_self_row(name):
+	timestamp = now()
+	frappe.db.bulk_insert(
+		"PRP Territory Closure",
+		["name", "creation", "modified", "owner", "modified_by", "ancestor", "descendant", "depth"],
+		[[get_closure_name(name, name), timestamp, timestamp, frappe.session.user, frappe.session.user, name, name, 0]],
+	)
+
+
+def remove_territory(name):
+	frappe.db.sql(
+		"DELETE FROM `tabPRP Territory Closure` WHERE ancestor = %(name)s OR descendant = %(name)s",
+		{"name": name},
+	)
+	clear_subtree_cache()
+
+
+def get_descendants(names, include_self=True, max_depth=None):
+	"""Get the names of every territory under any of the given territories"""
+	if isinstance(names, str):
+		names = [names]
+	if not names:
+		return []
+
+	conditions = ["ancestor IN %(names)s"]
+	if not include_self:
+		conditions.append("depth > 0")
+	if max_depth is not None:
+		conditions.append("depth <= %(max_depth)s")
+
+	return frappe.db.sql_list(
+		f"""
+		SELECT DISTINCT descendant
+		FROM `tabPRP Territory Closure`
+		WHERE {" AND ".join(conditions)}
+	""",
+		{"names": tuple(names), "max_depth": cint(max_depth)},
+	)
+
+
+def get_cached_descendants(territory):
+	"""Get the set of territories at or under a territory, served from a Redis hash"""
+	if not territory:
+		return set()
+	return set(frappe.cache().hget(SUBTREE_CACHE_KEY, territory, lambda: get_descendants(territory)))
+
+
+def get_subtree_version():
+	"""Get a token that changes whenever the hierarchy does, for caches derived from it"""
+	version = frappe.cache().get_value(SUBTREE_VERSION_KEY)
+	if not version:
+		version = frappe.generate_hash(length=10)
+		frappe.cache().set_value(SUBTREE_VERSION_KEY, version)
+	return version
+
+
+def clear_subtree_cache():
+	# Cleared again when the transaction ends, as readers in between may cache the old tree
+	reset_subtree_cache()
+	prp.run_after_commit(reset_subtree_cache)
+	frappe.db.after_rollback.add(reset_subtree_cache)
+
+
+def reset_subtree_cache():
+	frappe.cache().delete_key(SUBTREE_CACHE_KEY)
+	frappe.cache().set_value(SUBTREE_VERSION_KEY, frappe.generate_hash(length=10))
+
+
+def get_ancestors(name, fields=None):
+	"""Get a territory followed by its ancestors up to the root, nearest first"""
+	fields = fields or SUBTREE_FIELDS
+	return frappe.db.sql(
+		f"""
+		SELECT {", ".join(f"t.`{field}`" for field in fields)}, c.depth
+		FROM `tabPRP Territory Closure` c
+		INNER JOIN `tabPRP Territory` t ON t.name = c.ancestor
+		WHERE c.descendant = %s
+		ORDER BY c.depth
+	""",
+		name,
+		as_dict=True,
+	)
+
+
+@frappe.whitelist()
+def get_territory_subtree(territory, include_self=1, max_depth=None, is_project=None, is_phase=None):
+	"""Get the territories under a territory with their depth below it"""
+	frappe.has_permission("PRP Territory", "read", throw=True)
+
+	conditions = ["c.ancestor = %(territory)s"]
+	if not cint(include_self):
+		conditions.append("c.depth > 0")
+	if max_depth is not None:
+		conditions.append("c.depth <= %(max_depth)s")
+	if is_project is not None:
+		conditions.append("t.is_project = %(is_project)s")
+	if is_phase is not None:
+		conditions.append("t.is_phase = %(is_phase)s")
+
+	return frappe.db.sql(
+		f"""
+		SELECT {", ".join(f"t.`{field}`" for field in SUBTREE_FIELDS)}, c.depth
+		FROM `tabPRP Territory Closure` c
+		INNER JOIN `tabPRP Territory` t ON t.name = c.descendant
+		WHERE {" AND ".join(conditions)}
+		ORDER BY c.depth, t.name_en
+	""",
+		{
+			"territory": territory,
+			"max_depth": cint(max_depth),
+			"is_project": cint(is_project),
+			"is_phase": cint(is_phase),
+		},
+		as_dict=True,
+	)
+
+
+@frappe.whitelist()
+def get_territory_ancestors(territory):
+	"""Get the ancestors of a territory from the root down, excluding itself"""
+	frappe.has_permission("PRP Territory", "read", throw=True)
+
+	return list(reversed(get_ancestors(territory)[1:]))
+
+
+@frappe.whitelist()
+def rebuild_territory_closure():
+	"""Rebuild the whole closure table from parent_territory"""
+	frappe.only_for("System Manager")
+
+	parents = dict(frappe.get_all("PRP Territory", fields=["name", "parent_territory"], as_list=True))
+
+	timestamp = now()
+	user = frappe.session.user
+	values = []
+	for name in parents:
+		depth = 0
+		ancestor = name
+		seen = set()
+		while ancestor and ancestor not in seen and (ancestor == name or ancestor in parents):
+			seen.add(ancestor)
+			values.append(
+				[get_closure_name(ancestor, name), timestamp, timestamp, user, user, ancestor, name, depth]
+			)
+			ancestor = parents.get(ancestor)
+			depth += 1
+
+	frappe.db.delete("PRP Territory Closure")
+	frappe.db.bulk_insert(
+		"PRP Territory Closure",
+		["name", "creation", "modified", "owner", "modified_by", "ancestor", "descendant", "depth"],
+		values,
+	)
+	clear_subtree_cache()
+
+	return {"success": True, "message": f"Rebuilt {len(values)} closure rows for {len(parents)} territories"}
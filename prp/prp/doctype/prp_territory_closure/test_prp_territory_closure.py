@@ -0,0 +1,75 @@
+# Copyright (c) 2025, Yamen Zakhour and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests import IntegrationTestCase, UnitTestCase
+
+from prp.prp.doctype.prp_territory_closure.prp_territory_closure import (
+	get_descendants,
+	set_territory_parents,
+)
+
+# On IntegrationTestCase, the doctype test records and all
+# link-field test record dependencies are recursively loaded
+# Use these module variables to add/remove to/from that list
+EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+
+
+class UnitTestPRPTerritoryClosure(UnitTestCase):
+	"""
+	Unit tests for PRPTerritoryClosure.
+	Use this class for testing individual functions and methods.
+	"""
+
+	pass
+
+
+class IntegrationTestPRPTerritoryClosure(IntegrationTestCase):
+	"""
+	Integration tests for PRPTerritoryClosure.
+	Use this class for testing interactions between multiple components.
+	"""
+
+	def setUp(self):
+		# A > B > C and a second root D
+		set_territory_parents({"_Test A": None, "_Test D": None})
+		set_territory_parents({"_Test B": "_Test A"})
+		set_territory_parents({"_Test C": "_Test B"})
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def get_ancestors(self, name):
+		return dict(
+			frappe.get_all(
+				"PRP Territory Closure",
+				filters={"descendant": name},
+				fields=["ancestor", "depth"],
+				as_list=True,
+			)
+		)
+
+	def test_closure_rows(self):
+		self.assertEqual(self.get_ancestors("_Test C"), {"_Test C": 0, "_Test B": 1, "_Test A": 2})
+		self.assertEqual(set(get_descendants("_Test A")), {"_Test A", "_Test B", "_Test C"})
+
+	def test_move_subtree(self):
+		set_territory_parents({"_Test B": "_Test D"})
+
+		self.assertEqual(self.get_ancestors("_Test B"), {"_Test B": 0, "_Test D": 1})
+		self.assertEqual(self.get_ancestors("_Test C"), {"_Test C": 0, "_Test B": 1, "_Test D": 2})
+		self.assertEqual(set(get_descendants("_Test A")), {"_Test A"})
+		self.assertEqual(set(get_descendants("_Test D")), {"_Test D", "_Test B", "_Test C"})
+
+	def test_detach_subtree(self):
+		set_territory_parents({"_Test B": None})
+
+		self.assertEqual(self.get_ancestors("_Test C"), {"_Test C": 0, "_Test B": 1})
+		self.assertEqual(set(get_descendants("_Test A")), {"_Test A"})
+
+	def test_move_under_own_descendant(self):
+		set_territory_parents({"_Test A": "_Test C"})
+
+		self.assertEqual(self.get_ancestors("_Test A"), {"_Test A": 0})
+		self.assertEqual(self.get_ancestors("_Test C"), {"_Test C": 0, "_Test B": 1, "_Test A": 2})
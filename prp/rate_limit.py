@@ -0,0 +1,63 @@
+"""
+Cross-worker token bucket rate limiting backed by Redis.
+
+Every caller reserves a token atomically and only sleeps if the bucket was empty,
+so a burst within the allowed rate costs nothing while sustained traffic is
+spaced out evenly across all web and background workers of the site.
+"""
+
+import time
+
+import frappe
+
+# Refill the bucket for the time elapsed since the last call, then take a token.
+# The balance may go negative: each caller reserves its slot and is told how long
+# to wait for it, so concurrent callers queue up instead of retrying.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000) - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) * 1000 / rate) + 1000)
+
+if tokens >= 0 then
+    return 0
+end
+return math.ceil(-tokens * 1000 / rate)
+"""
+
+# name -> (tokens per second, burst capacity)
+RATE_LIMITS = {
+    # https://operations.osmfoundation.org/policies/nominatim/ allows at most 1 request per second
+    "nominatim": (1, 1),
+    "overpass": (1, 2),
+}
+
+_token_bucket = None
+
+
+def acquire(name):
+    """Take a token from the named bucket, sleeping only if none is available"""
+    global _token_bucket
+
+    rate, capacity = RATE_LIMITS[name]
+
+    try:
+        cache = frappe.cache()
+        if _token_bucket is None:
+            _token_bucket = cache.register_script(TOKEN_BUCKET_SCRIPT)
+        wait_ms = _token_bucket(keys=[cache.make_key(f"prp:rate_limit:{name}")], args=[rate, capacity])
+    except Exception as e:
+        # Without Redis we can't coordinate with other workers; assume the worst
+        frappe.log(f"Rate limiter unavailable for {name}: {str(e)}")
+        wait_ms = 1000 / rate
+
+    if wait_ms:
+        time.sleep(wait_ms / 1000)
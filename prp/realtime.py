@@ -0,0 +1,204 @@
+"""
+Batched publishing of prp:refetch_resource events.
+
+Changes raised during a request or background job are buffered per cache key
+and published once the transaction commits, as one message per cache key, or
+dropped if it rolls back. Several changes to the same document are merged, so
+a bulk import sends one message per doctype instead of one per document.
+
+With "prp_realtime_debounce_ms" set in site config, committed batches are held
+in Redis. The first one held opens a window and schedules a job for when it
+closes; that job, or any commit after the window has lasted long enough,
+publishes everything held as one message per cache key. A scheduler tick
+every minute catches windows whose job was lost. Bursts spread over many
+requests then still reach clients as one message per window.
+
+Batches go to the doctype's realtime room and single changes to the document's
+room, instead of to every session on the site.
+"""
+
+import time
+from datetime import timedelta
+
+import frappe
+from frappe.realtime import get_doctype_room
+from frappe.utils import cint
+from frappe.utils.background_jobs import execute_job, get_queue
+
+REALTIME_VERSION_KEY = "prp:realtime_version"
+
+REALTIME_PENDING_KEY = "prp:realtime_pending"
+REALTIME_WINDOW_KEY = "prp:realtime_window"
+
+# Batches with more changes than this skip the per document messages
+REALTIME_DOC_UPDATE_LIMIT = 20
+
+# A window left open, by a crashed process say, is closed after this many seconds
+REALTIME_WINDOW_TTL = 3600
+
+
+def queue_refetch_event(cache_key, doctype, change):
+    """Buffer a change until the current transaction commits
+
+    change: {"doc", "event", "action", "data"}
+    """
+    pending = getattr(frappe.local, "prp_realtime_events", None)
+    if not pending:
+        pending = frappe.local.prp_realtime_events = {}
+        frappe.db.after_commit.add(flush_realtime_events)
+        frappe.db.after_rollback.add(clear_realtime_events)
+
+    batch = pending.setdefault(cache_key, {"doctype": doctype, "changes": {}})
+    merge_change(batch["changes"], change)
+
+
+def merge_change(changes, change):
+    """Add a change to {document name: change}, merging it with an earlier one for the same document"""
+    name = change["doc"]
+    earlier = changes.get(name) if name else None
+    if not earlier:
+        changes[name or frappe.generate_hash(length=10)] = change
+        return
+
+    if change["action"] == "delete" or not (earlier["data"] and change["data"]):
+        data = change["data"]
+    else:
+        data = {**earlier["data"], **change["data"]}
+
+    changes[name] = {
+        "doc": name,
+        "event": "list_update" if "list_update" in (earlier["event"], change["event"]) else change["event"],
+        # An insert followed by updates is still an insert for clients
+        "action": "insert" if earlier["action"] == "insert" and change["action"] == "update" else change["action"],
+        "data": data,
+    }
+
+
+def clear_realtime_events():
+    frappe.local.prp_realtime_events = {}
+
+
+def flush_realtime_events():
+    pending = getattr(frappe.local, "prp_realtime_events", None) or {}
+    frappe.local.prp_realtime_events = {}
+
+    debounce_ms = cint(frappe.conf.get("prp_realtime_debounce_ms"))
+    for cache_key, batch in pending.items():
+        changes = list(batch["changes"].values())
+        if debounce_ms > 0:
+            hold_refetch_event(cache_key, batch["doctype"], changes)
+        else:
+            publish_refetch_event(cache_key, batch["doctype"], changes)
+
+    if debounce_ms > 0:
+        publish_held_events()
+
+
+def hold_refetch_event(cache_key, doctype, changes):
+    """Keep a committed batch in Redis until the debounce window closes"""
+    cache = frappe.cache()
+    cache.hset(
+        REALTIME_PENDING_KEY,
+        f"{time.time_ns()}:{frappe.generate_hash(length=6)}",
+        {"cache_key": cache_key, "doctype": doctype, "changes": changes},
+    )
+
+    # The first batch held opens the window and schedules its closing
+    if cache.set(cache.make_key(REALTIME_WINDOW_KEY), time.time(), nx=True, ex=REALTIME_WINDOW_TTL):
+        schedule_held_events(cint(frappe.conf.get("prp_realtime_debounce_ms")))
+
+
+def schedule_held_events(delay_ms):
+    """Run publish_held_events in a worker once the window has lasted delay_ms"""
+    method = "prp.realtime.publish_held_events"
+    get_queue("short").enqueue_in(
+        timedelta(milliseconds=delay_ms),
+        execute_job,
+        kwargs={
+            "site": frappe.local.site,
+            "user": frappe.session.user,
+            "method": method,
+            "event": None,
+            "job_name": method,
+            "kwargs": {},
+            "is_async": True,
+        },
+    )
+
+
+def publish_held_events():
+    """Publish every held batch once the debounce window has closed
+
+    Runs after each commit that raised events, from the job scheduled when the
+    window opened and, as a fallback, from the scheduler every minute.
+    """
+    debounce_ms = cint(frappe.conf.get("prp_realtime_debounce_ms"))
+    if debounce_ms <= 0:
+        return
+
+    cache = frappe.cache()
+    window_key = cache.make_key(REALTIME_WINDOW_KEY)
+
+    opened = cache.get(window_key)
+    if not opened:
+        return
+    if (time.time() - float(opened)) * 1000 < debounce_ms:
+        return
+
+    # Only the process that closes the window publishes, batches held from here on open a new one
+    if not cache.delete(window_key):
+        return
+
+    held = cache.hgetall(REALTIME_PENDING_KEY)
+
+    batches = {}
+    for key in sorted(held):
+        cache.hdel(REALTIME_PENDING_KEY, key)
+        batch = held[key]
+        changes = batches.setdefault(batch["cache_key"], {"doctype": batch["doctype"], "changes": {}})["changes"]
+        for change in batch["changes"]:
+            merge_change(changes, change)
+
+    for cache_key, batch in batches.items():
+        publish_refetch_event(cache_key, batch["doctype"], list(batch["changes"].values()))
+
+
+def publish_refetch_event(cache_key, doctype, changes):
+    """Publish a batch to the doctype's room and each change to its document's room
+
+    Clients join these rooms with doctype_subscribe and doc_subscribe, so only
+    sessions showing the list or the document receive the messages. Batches of
+    more than REALTIME_DOC_UPDATE_LIMIT changes are only sent to the doctype's
+    room, with doc_updates unset, and open documents are refreshed from there.
+    """
+    docs = [change["doc"] for change in changes if change["doc"]]
+    doc_updates = len(docs) <= REALTIME_DOC_UPDATE_LIMIT
+
+    frappe.publish_realtime(
+        "prp:refetch_resource",
+        {
+            "cache_key": cache_key,
+            "doctype": doctype,
+            "event": "list_update" if any(change["event"] == "list_update" for change in changes) else "doc_update",
+            "doc": docs[0] if len(docs) == 1 else None,
+            "docs": docs,
+            "version": get_next_version(cache_key),
+            "changes": changes,
+            "doc_updates": doc_updates,
+        },
+        room=get_doctype_room(doctype),
+    )
+
+    if not doc_updates:
+        return
+
+    for change in changes:
+        if change["doc"]:
+            frappe.publish_realtime(
+                "prp:doc_update", {"doctype": doctype, **change}, doctype=doctype, docname=change["doc"]
+            )
+
+
+def get_next_version(cache_key):
+    cache = frappe.cache()
+    return cache.incr(cache.make_key(f"{REALTIME_VERSION_KEY}:{cache_key}"))
@@ -0,0 +1,161 @@
+"""
+Incremental sync of PRP documents for clients holding cached lists.
+
+A client keeps the cursor returned by get_changes and passes it back to get
+only the documents modified since, along with the names of the documents
+deleted since (from the Deleted Document log). Modified documents are paged
+by (modified, name) and deletions by (creation, name), so a page boundary
+inside a run of equal timestamps neither skips rows nor repeats them.
+
+Limitations:
+- A save that commits after a later one, and so carries a modified older than
+  a cursor already handed out, is missed until the client reloads its list.
+- Deletions are only reported for documents the user could read, judged from
+  their values when deleted. A document that leaves the user's permissions by
+  being edited is not reported as removed.
+"""
+
+import frappe
+from frappe.model import no_value_fields
+from frappe.utils import cint, get_datetime, now
+
+from prp import BULKY_FIELDTYPES
+
+SYNC_PAGE_LENGTH = 500
+
+STANDARD_SYNC_FIELDS = ["name", "creation", "modified", "owner", "modified_by"]
+
+
+def check_sync_doctype(doctype):
+    meta = frappe.get_meta(doctype)
+    if meta.module != "PRP" or meta.istable or meta.issingle:
+        frappe.throw(f"Cannot sync {doctype}", frappe.PermissionError)
+    return meta
+
+
+def get_sync_fields(meta):
+    """Get the columns clients keep in their lists, leaving out tables and large fields"""
+    return STANDARD_SYNC_FIELDS + [
+        df.fieldname
+        for df in meta.fields
+        if df.fieldtype not in no_value_fields and df.fieldtype not in BULKY_FIELDTYPES
+    ]
+
+
+def get_modified_rows(doctype, cursor, fields, limit):
+    """Get up to limit + 1 rows after the cursor in (modified, name) order"""
+    rows = frappe.get_list(
+        doctype,
+        filters=[["modified", "=", cursor.modified], ["name", ">", cursor.name or ""]],
+        fields=fields,
+        order_by="name asc",
+        limit=limit + 1,
+    )
+    if len(rows) <= limit:
+        rows += frappe.get_list(
+            doctype,
+            filters=[["modified", ">", cursor.modified]],
+            fields=fields,
+            order_by="modified asc, name asc",
+            limit=limit + 1 - len(rows),
+        )
+    return rows
+
+
+def get_deleted_rows(doctype, cursor, limit):
+    """Get up to limit + 1 deletions after the cursor in (creation, name) order"""
+    fields = ["name", "deleted_name", "creation", "data"]
+    rows = frappe.get_all(
+        "Deleted Document",
+        filters=[
+            ["deleted_doctype", "=", doctype],
+            ["creation", "=", cursor.deleted],
+            ["name", ">", cursor.deleted_name or ""],
+        ],
+        fields=fields,
+        order_by="name asc",
+        limit=limit + 1,
+    )
+    if len(rows) <= limit:
+        rows += frappe.get_all(
+            "Deleted Document",
+            filters=[["deleted_doctype", "=", doctype], ["creation", ">", cursor.deleted]],
+            fields=fields,
+            order_by="creation asc, name asc",
+            limit=limit + 1 - len(rows),
+        )
+    return rows
+
+
+def get_permitted_deletions(doctype, rows):
+    """Get the names of the deleted documents the user could read before they were deleted"""
+    if frappe.session.user == "Administrator":
+        return [row.deleted_name for row in rows]
+
+    names = []
+    for row in rows:
+        try:
+            doc = frappe.get_doc(frappe.parse_json(row.data))
+        except Exception:
+            continue
+        if frappe.has_permission(doctype, "read", doc=doc):
+            names.append(row.deleted_name)
+    return names
+
+
+@frappe.whitelist()
+def get_changes(doctype, cursor=None, fields=None, limit=SYNC_PAGE_LENGTH):
+    """Get the documents of a PRP doctype modified or deleted since a cursor
+
+    Without a cursor only a cursor for the current moment is returned; take it
+    before loading a list so nothing changed during the load is missed.
+
+    has_more: call again with the returned cursor to get the rest
+    inserted: names among the changes created after the cursor
+    deleted: names of the deleted documents the user could read
+    """
+    meta = check_sync_doctype(doctype)
+    frappe.has_permission(doctype, "read", throw=True)
+
+    if not cursor:
+        timestamp = now()
+        return {
+            "success": True,
+            "changes": [],
+            "inserted": [],
+            "deleted": [],
+            "has_more": False,
+            "cursor": {"modified": timestamp, "name": "", "deleted": timestamp, "deleted_name": ""},
+        }
+
+    try:
+        cursor = frappe._dict(frappe.parse_json(cursor))
+        limit = min(cint(limit) or SYNC_PAGE_LENGTH, SYNC_PAGE_LENGTH)
+
+        fields = frappe.parse_json(fields) if fields else get_sync_fields(meta)
+        fields = list(dict.fromkeys(["name", "creation", "modified", *fields]))
+
+        rows = get_modified_rows(doctype, cursor, fields, limit)
+        deleted = get_deleted_rows(doctype, cursor, limit)
+
+        has_more = len(rows) > limit or len(deleted) > limit
+        rows = rows[:limit]
+        deleted = deleted[:limit]
+
+        since = get_datetime(cursor.modified)
+        return {
+            "success": True,
+            "changes": rows,
+            "inserted": [row.name for row in rows if row.creation > since],
+            "deleted": get_permitted_deletions(doctype, deleted),
+            "has_more": has_more,
+            "cursor": {
+                "modified": str(rows[-1].modified) if rows else cursor.modified,
+                "name": rows[-1].name if rows else cursor.name,
+                "deleted": str(deleted[-1].creation) if deleted else cursor.deleted,
+                "deleted_name": deleted[-1].name if deleted else cursor.deleted_name,
+            },
+        }
+    except Exception as e:
+        frappe.log_error(f"Error syncing {doctype}: {str(e)}", "PRP Sync")
+        return {"success": False, "message": str(e)}